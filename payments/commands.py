@@ -0,0 +1,143 @@
+import json
+import subprocess
+import sys
+
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("stripe-backfill-events")
+@click.option(
+	"--since", required=True, help="Replay the events created after this datetime (YYYY-MM-DD HH:MM:SS)"
+)
+@click.option("--account", multiple=True, help="Stripe Settings to backfill. Defaults to all accounts")
+@pass_context
+def stripe_backfill_events(context, since, account=None):
+	"Replay missed Stripe webhook events from the Stripe Events API"
+	from payments.payment_gateways.doctype.stripe_settings.stripe_settings import (
+		backfill_webhook_events,
+	)
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		frappe.set_user("Administrator")
+		backfill_webhook_events(since, accounts=list(account))
+		click.secho("Stripe event backfill enqueued", fg="green")
+	finally:
+		frappe.destroy()
+
+
+GATEWAY_MODULES = {
+	"payments.payment_gateways.doctype.braintree_settings.braintree_settings": "braintree",
+	"payments.payment_gateways.doctype.paytm_settings.paytm_settings": "paytmchecksum",
+	"payments.payment_gateways.doctype.razorpay_settings.razorpay_settings": "razorpay",
+	"payments.payment_gateways.doctype.stripe_settings.stripe_settings": "stripe",
+}
+
+# Run in a fresh interpreter for each module, so that nothing is already imported or cached
+IMPORT_BENCHMARK_SCRIPT = """
+import importlib, json, resource, sys, time
+
+def measure(module):
+	start = time.perf_counter()
+	importlib.import_module(module)
+	return time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+import frappe
+base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+module_time, module_rss = measure(sys.argv[1])
+sdk_loaded = sys.argv[2] in sys.modules
+sdk_time, sdk_rss = measure(sys.argv[2])
+print(json.dumps({
+	"module_time": module_time,
+	"module_rss": module_rss - base_rss,
+	"sdk_loaded": sdk_loaded,
+	"sdk_time": sdk_time,
+	"sdk_rss": sdk_rss - module_rss,
+}))
+"""
+
+
+@click.command("payments-benchmark-imports")
+def payments_benchmark_imports():
+	"Measure the import time and memory of each gateway module and of the SDK it loads on first use"
+	click.echo(
+		f"{'Module':<20}{'Import (ms)':>14}{'RSS (KiB)':>12}{'SDK loaded':>12}{'SDK (ms)':>12}{'SDK RSS (KiB)':>16}"
+	)
+
+	for module, sdk in GATEWAY_MODULES.items():
+		result = subprocess.run(
+			[sys.executable, "-c", IMPORT_BENCHMARK_SCRIPT, module, sdk],
+			capture_output=True,
+			text=True,
+		)
+		name = module.rsplit(".", 1)[-1]
+		if result.returncode:
+			error = (result.stderr.strip().splitlines() or ["Import failed"])[-1]
+			click.secho(f"{name:<20}{error}", fg="red")
+			continue
+
+		timings = json.loads(result.stdout)
+		click.echo(
+			f"{name:<20}{timings['module_time'] * 1000:>14.1f}{timings['module_rss']:>12}"
+			f"{'yes' if timings['sdk_loaded'] else 'no':>12}{timings['sdk_time'] * 1000:>12.1f}"
+			f"{timings['sdk_rss']:>16}"
+		)
+
+
+@click.command("payments-benchmark-json")
+@click.option("--limit", default=1000, help="Number of Integration Requests to sample")
+@click.option("--rounds", default=20, help="Number of times each payload is decoded and encoded")
+@pass_context
+def payments_benchmark_json(context, limit=1000, rounds=20):
+	"Compare the JSON codec of the app with the standard library on stored Integration Requests"
+	import timeit
+
+	from payments.utils import codec
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		payloads = [
+			data
+			for data in frappe.get_all(
+				"Integration Request",
+				fields=["data"],
+				order_by="creation desc",
+				limit=limit,
+				pluck="data",
+			)
+			if data
+		]
+	finally:
+		frappe.destroy()
+
+	if not payloads:
+		click.secho("No Integration Request to benchmark", fg="yellow")
+		return
+
+	if codec.get_backend() == "json":
+		click.secho("orjson is not installed: the codec uses the standard library", fg="yellow")
+
+	decoded = [json.loads(payload) for payload in payloads]
+	codecs = {
+		"json": (json.loads, lambda obj: json.dumps(obj, default=str)),
+		codec.get_backend(): (codec.loads, codec.dumps),
+	}
+
+	click.echo(
+		f"{len(payloads)} payloads, {sum(len(payload) for payload in payloads) // len(payloads)} bytes on average"
+	)
+	click.echo(f"{'Backend':<10}{'Decode (µs)':>14}{'Encode (µs)':>14}")
+	for name, (loads, dumps) in codecs.items():
+		decode_time = timeit.timeit(lambda: [loads(payload) for payload in payloads], number=rounds)
+		encode_time = timeit.timeit(lambda: [dumps(obj) for obj in decoded], number=rounds)
+		per_payload = 1e6 / (rounds * len(payloads))
+		click.echo(f"{name:<10}{decode_time * per_payload:>14.2f}{encode_time * per_payload:>14.2f}")
+
+
+commands = [stripe_backfill_events, payments_benchmark_imports, payments_benchmark_json]
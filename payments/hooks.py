@@ -65,6 +65,7 @@ app_license = "MIT"
 
 before_install = "payments.utils.before_install"
 after_install = "payments.utils.after_install"
+after_migrate = "payments.utils.after_migrate"
 
 # Uninstallation
 # ------------
@@ -95,7 +96,8 @@ before_uninstall = "payments.utils.delete_custom_fields"
 # Override standard doctype classes
 
 override_doctype_class = {
-	"Web Form": "payments.overrides.payment_webform.PaymentWebForm"
+	"Web Form": "payments.overrides.payment_webform.PaymentWebForm",
+	"Integration Request": "payments.overrides.integration_request.ArchivableIntegrationRequest",
 }
 
 webhooks_handler = {
@@ -120,6 +122,18 @@ webhooks_handler = {
 scheduler_events = {
 	"all": [
 		"payments.payment_gateways.doctype.razorpay_settings.razorpay_settings.capture_payment",
+		"payments.payment_gateways.doctype.braintree_settings.braintree_settings.refill_client_token_pools",
+	],
+	"hourly": [
+		"payments.payment_gateways.doctype.paypal_settings.paypal_settings.retry_subscription_notifications",
+		"payments.payment_gateways.doctype.paytm_settings.paytm_settings.reconcile_pending_orders",
+		"payments.payment_gateways.doctype.braintree_settings.braintree_settings.refresh_merchant_account_index",
+		"payments.utils.checkout.expire_abandoned_checkouts",
+	],
+	"daily": [
+		"payments.payment_gateways.doctype.paypal_settings.paypal_settings.sync_recurring_profiles",
+		"payments.payment_gateways.doctype.braintree_settings.braintree_settings.sync_settlement_status",
+		"payments.payments.doctype.integration_request_archive.integration_request_archive.archive_integration_requests",
 	],
 }
 
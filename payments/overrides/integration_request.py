@@ -0,0 +1,209 @@
+import frappe
+from frappe.integrations.doctype.integration_request.integration_request import (
+	IntegrationRequest,
+)
+from frappe import _
+from frappe.utils import cint, now
+
+from payments.payments.doctype.integration_request_archive.integration_request_archive import (
+	get_archived_integration_request,
+)
+from payments.utils import codec
+from payments.utils.integration_request import get_projected_fields, is_valid_status_transition
+
+# Concurrent status updates are retried from the current state of the request this many times
+MAX_STATUS_UPDATE_ATTEMPTS = 3
+
+
+class ArchivableIntegrationRequest(IntegrationRequest):
+	"""Integration Request read through to the archive when it is no longer in the table,
+	with the frequently queried keys of its `data` projected into indexed columns"""
+
+	def validate(self):
+		if hasattr(super(), "validate"):
+			super().validate()
+
+		self.validate_status_transition()
+		self.update(get_projected_fields(self.data, self))
+
+	def validate_status_transition(self):
+		previous = self.get_doc_before_save()
+		if previous and not is_valid_status_transition(previous.status, self.status):
+			frappe.throw(
+				_("Integration Request {0} cannot go from {1} to {2}").format(
+					self.name, _(previous.status), _(self.status)
+				)
+			)
+
+	def load_from_db(self):
+		try:
+			super().load_from_db()
+		except frappe.DoesNotExistError:
+			archived = get_archived_integration_request(self.name)
+			if not archived:
+				raise
+
+			# Drop the "not found" message queued by the failed lookup
+			frappe.clear_last_message()
+			self.update(archived)
+			self.flags.archived = True
+
+	def check_if_latest(self):
+		# Runs first in `save`, and would not find the archived request in the table
+		if self.flags.archived:
+			self.restore_from_archive()
+
+		super().check_if_latest()
+
+	def db_set(self, fieldname, value=None, *args, **kwargs):
+		if self.flags.archived:
+			self.restore_from_archive()
+
+		values = fieldname if isinstance(fieldname, dict) else {fieldname: value}
+		if "data" in values:
+			values = {**get_projected_fields(values["data"], self), **values}
+			return super().db_set(values, None, *args, **kwargs)
+
+		return super().db_set(fieldname, value, *args, **kwargs)
+
+	def restore_from_archive(self):
+		"""Move an archived request back to the table before writing to it"""
+		self.db_insert()
+		frappe.db.delete("Integration Request Archive", {"name": self.name})
+		self.flags.archived = False
+
+	def update_status(self, params, status, fields=None):
+		"""Merge `params` into `data` and set the status in a single statement.
+		Other columns, like `error` or `output`, can be set at the same time through `fields`.
+
+		Only the changed keys are sent to the database: the stored `data` is patched in place
+		instead of being decoded, merged and written back with a full save. Each top-level key of
+		`params` replaces the stored one, keys set to None are removed. The same rule is applied
+		to the document, which is kept in sync: no reload is needed.
+
+		The update is a compare-and-set on the status and `status_version` read with the document,
+		so no row lock is held between the read and the write. When another worker changed the
+		request in the meantime, its current state is read again with a row lock and the transition
+		is checked from there.
+
+		Returns True only if this call changed the status, so that a single worker runs the side
+		effects of a transition. Returns False, without writing, if the transition is not allowed:
+		the document then holds the status set by the other worker. Updates that keep the status,
+		including when another worker already moved the request to `status`, are written and
+		return False.
+		"""
+		if self.flags.archived:
+			self.restore_from_archive()
+
+		params = params or {}
+		data_sql, data_values = get_data_update_sql(params)
+
+		for _attempt in range(MAX_STATUS_UPDATE_ATTEMPTS):
+			if not is_valid_status_transition(self.status, status):
+				# Releases the row lock of a re-read
+				frappe.db.commit()
+				return False
+
+			values = {
+				**get_projected_fields(params, self),
+				**(fields or {}),
+				"status": status,
+				"status_version": cint(self.status_version) + 1,
+				"modified": now(),
+				"modified_by": frappe.session.user,
+			}
+
+			updated = compare_and_set(
+				"""update `tabIntegration Request`
+				set `data` = {0}, {1}
+				where `name` = %(name)s and `status` = %(current_status)s
+					and `status_version` = %(current_version)s""".format(
+					data_sql, ", ".join(f"`{fieldname}` = %({fieldname})s" for fieldname in values)
+				),
+				{
+					**values,
+					**data_values,
+					"name": self.name,
+					"current_status": self.status,
+					"current_version": cint(self.status_version),
+				},
+			)
+			if updated:
+				break
+
+			# Updated by another worker: start again from its state. The locking read sees
+			# the latest committed row, a plain read would return the transaction snapshot.
+			self.status, self.status_version, self.data = frappe.db.get_value(
+				"Integration Request",
+				self.name,
+				["status", "status_version", "data"],
+				for_update=True,
+			)
+		else:
+			frappe.db.commit()
+			return False
+
+		status_changed = self.status != status
+
+		self.data = codec.dumps(update_data(codec.loads(self.data) if self.data else {}, params))
+		self.update(values)
+
+		frappe.db.commit()
+		return status_changed
+
+
+def compare_and_set(query, values):
+	"""Run a conditional update of a single row and return whether the row was updated"""
+	if frappe.db.db_type == "postgres":
+		return bool(frappe.db.sql(f"{query} returning `name`", values))
+
+	frappe.db.sql(query, values)
+	return bool(frappe.db.sql("select row_count()")[0][0])
+
+
+def update_data(data, params):
+	"""Replace the top-level keys of `data` by the ones of `params`, removing the keys set to None"""
+	for key, value in params.items():
+		if value is None:
+			data.pop(key, None)
+		else:
+			data[key] = value
+
+	return data
+
+
+def get_data_update_sql(params):
+	"""Returns the SQL expression applying `update_data` to the stored `data`, and its parameters"""
+	removed_keys = [key for key, value in params.items() if value is None]
+	updated_keys = [key for key, value in params.items() if value is not None]
+	values = {"patch": codec.dumps({key: params[key] for key in updated_keys})}
+
+	if frappe.db.db_type == "postgres":
+		data_sql = "coalesce(nullif(`data`, ''), '{}')::jsonb"
+		if removed_keys:
+			data_sql = f"({data_sql} - %(removed_keys)s::text[])"
+			values["removed_keys"] = removed_keys
+
+		return f"({data_sql} || %(patch)s::jsonb)::text", values
+
+	# Values are copied from the patch with json_extract so that they keep their JSON type
+	data_sql = "if(json_valid(`data`), `data`, '{}')"
+	paths = {}
+	for index, key in enumerate(removed_keys + updated_keys):
+		paths[key] = f"path_{index}"
+		values[paths[key]] = '$."{0}"'.format(key.replace("\\", "\\\\").replace('"', '\\"'))
+
+	if removed_keys:
+		data_sql = "json_remove({0}, {1})".format(
+			data_sql, ", ".join(f"%({paths[key]})s" for key in removed_keys)
+		)
+
+	if updated_keys:
+		data_sql = "json_set({0}, {1})".format(
+			data_sql,
+			", ".join(
+				f"%({paths[key]})s, json_extract(%(patch)s, %({paths[key]})s)" for key in updated_keys
+			),
+		)
+
+	return data_sql, values
@@ -1,11 +1,9 @@
-import json
-
 import frappe
 from frappe.core.doctype.file import remove_file_by_url
 from frappe.rate_limiter import rate_limit
 from frappe.website.doctype.web_form.web_form import WebForm
 
-from payments.utils import get_payment_gateway_controller
+from payments.utils import codec, get_payment_gateway_controller
 
 
 class PaymentWebForm(WebForm):
@@ -57,7 +55,7 @@ class PaymentWebForm(WebForm):
 @rate_limit(key="web_form", limit=5, seconds=60, methods=["POST"])
 def accept(web_form, data, docname=None, for_payment=False):
 	"""Save the web form"""
-	data = frappe._dict(json.loads(data))
+	data = frappe._dict(codec.loads(data))
 	for_payment = frappe.parse_json(for_payment)
 
 	files = []
@@ -0,0 +1,5 @@
+from payments.utils.checkout import add_expired_status
+
+
+def execute():
+	add_expired_status()
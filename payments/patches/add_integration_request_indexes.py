@@ -0,0 +1,11 @@
+from payments.utils.integration_request import (
+	add_indexes,
+	backfill_projected_fields,
+	make_projected_fields,
+)
+
+
+def execute():
+	make_projected_fields()
+	add_indexes()
+	backfill_projected_fields()
@@ -0,0 +1,5 @@
+from payments.utils.integration_request import make_status_version_field
+
+
+def execute():
+	make_status_version_field()
@@ -0,0 +1,9 @@
+from payments.utils.integration_request import (
+	backfill_recurring_profile_ids,
+	make_projected_fields,
+)
+
+
+def execute():
+	make_projected_fields()
+	backfill_recurring_profile_ids()
@@ -1,18 +1,41 @@
 # Copyright (c) 2021, Frappe Technologies and contributors
 # License: MIT. See LICENSE
 
-
+import time
 from urllib.parse import urlencode
 
-import braintree
 import frappe
 from frappe import _
 from frappe.integrations.utils import (
 	PaymentGatewayController,
 	create_request_log,
 )
-from payments.utils import create_payment_gateway
-from frappe.utils import call_hook_method, get_url
+from payments.utils import codec, create_payment_gateway
+from payments.utils.cache import (
+	clear_settings_version,
+	get_process_cached_value,
+	get_settings_version,
+)
+from payments.utils.http import DEFAULT_TIMEOUT
+from frappe.utils import add_days, call_hook_method, create_batch, get_url, now_datetime
+
+MERCHANT_ACCOUNTS_CACHE_KEY = "braintree_merchant_accounts"
+CLIENT_TOKENS_CACHE_KEY = "braintree_client_tokens"
+
+CLIENT_TOKEN_POOL_SIZE = 20
+# Client tokens are valid for 24 hours: keep a comfortable margin before handing them out
+CLIENT_TOKEN_LIFETIME = 6 * 60 * 60
+
+SETTLEMENT_SWEEP_DAYS = 7
+
+# Values of `braintree.WebhookNotification.Kind`, spelled out so that the SDK
+# is only imported when used
+SETTLEMENT_WEBHOOK_KINDS = {
+	"transaction_settled": "settled",
+	"transaction_settlement_declined": "settlement_declined",
+	"transaction_disbursed": "disbursed",
+}
+DISBURSEMENT_WEBHOOK_KIND = "disbursement"
 
 
 class BraintreeSettings(PaymentGatewayController):
@@ -161,7 +184,7 @@ class BraintreeSettings(PaymentGatewayController):
 
 	def validate(self):
 		if not self.flags.ignore_mandatory:
-			self.configure_braintree()
+			self.gateway = self.get_braintree_gateway()
 
 	def on_update(self):
 		create_payment_gateway(
@@ -171,8 +194,24 @@ class BraintreeSettings(PaymentGatewayController):
 		)
 		call_hook_method("payment_gateway_enabled", gateway="Braintree-" + self.gateway_name)
 
+		clear_settings_version(self.doctype, self.name)
+		frappe.enqueue(
+			method="payments.payment_gateways.doctype.braintree_settings.braintree_settings.refresh_merchant_account_index",
+			queue="short",
+			enqueue_after_commit=True,
+			settings=self.name,
+		)
+
 	def configure_braintree(self):
-		self.gateway = braintree.BraintreeGateway(
+		# The gateway is shared by every document loaded in this process until the settings change
+		self.gateway = get_process_cached_value(
+			self.doctype, self.name, "gateway", self.get_braintree_gateway
+		)
+
+	def get_braintree_gateway(self):
+		import braintree
+
+		return braintree.BraintreeGateway(
 			braintree.Configuration(
 				environment=braintree.Environment.Sandbox
 				if self.use_sandbox
@@ -180,6 +219,8 @@ class BraintreeSettings(PaymentGatewayController):
 				merchant_id=self.merchant_id,
 				public_key=self.public_key,
 				private_key=self.get_password(fieldname="private_key", raise_exception=False),
+				# The SDK manages its own connections: only the read timeout can be aligned
+				timeout=DEFAULT_TIMEOUT[1],
 			)
 		)
 
@@ -189,10 +230,51 @@ class BraintreeSettings(PaymentGatewayController):
 
 		try:
 			self.get_merchant_account()
-			return self.gateway.client_token.generate({"merchant_account_id": self.merchant_account.id})
+			client_token = self.get_pooled_client_token(self.merchant_account.id)
+			if not client_token:
+				client_token = self.gateway.client_token.generate(
+					{"merchant_account_id": self.merchant_account.id}
+				)
+
+			return client_token
 		except Exception as e:
 			frappe.log_error(e, _("Client token generation issue"))
 
+	def get_client_token_pool_key(self, merchant_account_id):
+		return f"{CLIENT_TOKENS_CACHE_KEY}:{self.name}:{merchant_account_id}"
+
+	def get_pooled_client_token(self, merchant_account_id):
+		"""Return a pre-generated client token, or None if the pool is empty"""
+		key = self.get_client_token_pool_key(merchant_account_id)
+
+		while True:
+			entry = frappe.cache().lpop(key)
+			if not entry:
+				return
+
+			entry = codec.loads(entry)
+			if entry["expires_at"] > time.time():
+				return entry["token"]
+
+	def refill_client_token_pool(self, merchant_account_id):
+		key = self.get_client_token_pool_key(merchant_account_id)
+
+		# Tokens are appended in generation order, so the expired ones are at the head of the list
+		while True:
+			head = frappe.cache().lrange(key, 0, 0)
+			if not head or codec.loads(head[0])["expires_at"] > time.time():
+				break
+			frappe.cache().lpop(key)
+
+		for _i in range(CLIENT_TOKEN_POOL_SIZE - frappe.cache().llen(key)):
+			token = self.gateway.client_token.generate({"merchant_account_id": merchant_account_id})
+			frappe.cache().rpush(
+				key, codec.dumps({"token": token, "expires_at": time.time() + CLIENT_TOKEN_LIFETIME})
+			)
+
+		# Concurrent refills may overshoot the pool size
+		frappe.cache().ltrim(key, -CLIENT_TOKEN_POOL_SIZE, -1)
+
 	def validate_transaction_currency(self, currency):
 		if currency not in self.supported_currencies:
 			frappe.throw(
@@ -224,19 +306,33 @@ class BraintreeSettings(PaymentGatewayController):
 			}
 
 	def get_merchant_account(self):
+		merchant_account_id = self.get_merchant_account_index().get(self.data.currency)
+
+		if merchant_account_id:
+			self.merchant_account = frappe._dict(id=merchant_account_id)
+		else:
+			frappe.log_error(_(f"Merchant account for currency {self.data.currency} missing"))
+
+	def get_merchant_account_index(self):
+		"""Return a mapping of currencies to merchant account ids, built once per settings version"""
+		index = frappe.cache().hget(MERCHANT_ACCOUNTS_CACHE_KEY, self.name)
+		if not index or index.get("version") != get_settings_version(self.doctype, self.name):
+			index = self.build_merchant_account_index()
+
+		return index.get("accounts")
+
+	def build_merchant_account_index(self):
+		accounts = {}
 		result = self.gateway.merchant_account.all()
-		matching_merchants = [
-			x for x in result.merchant_accounts if x.currency_iso_code == self.data.currency
-		]
-		default_merchant = [y for y in matching_merchants if y.default] if matching_merchants else []
+		for merchant_account in result.merchant_accounts:
+			# The default merchant account takes precedence over the others in the same currency
+			if merchant_account.default or merchant_account.currency_iso_code not in accounts:
+				accounts[merchant_account.currency_iso_code] = merchant_account.id
 
-		if default_merchant:
-			self.merchant_account = default_merchant[0]
-		elif matching_merchants:
-			self.merchant_account = matching_merchants[0]
+		index = {"version": get_settings_version(self.doctype, self.name), "accounts": accounts}
+		frappe.cache().hset(MERCHANT_ACCOUNTS_CACHE_KEY, self.name, index)
 
-		if not hasattr(self, "merchant_account"):
-			frappe.log_error(_(f"Merchant account for currency {self.data.currency} missing"))
+		return index
 
 	def create_charge_on_braintree(self):
 		self.get_merchant_account()
@@ -256,31 +352,31 @@ class BraintreeSettings(PaymentGatewayController):
 			}
 		)
 
+		# The outcome is written to the integration request in a single update
 		if result.is_success:
-			self.integration_request.db_set("status", "Completed", update_modified=False)
-			self.flags.status_changed_to = "Completed"
-			self.integration_request.db_set(
-				"output", result.transaction.status, update_modified=False
-			)
+			if self.integration_request.update_status(
+				{},
+				"Completed",
+				fields={"output": result.transaction.status, "service_id": result.transaction.id},
+			):
+				self.flags.status_changed_to = "Completed"
 
-		elif result.transaction:
-			self.integration_request.db_set("status", "Failed", update_modified=False)
-			error_log = frappe.log_error(
-				"code: "
-				+ str(result.transaction.processor_response_code)
-				+ " | text: "
-				+ str(result.transaction.processor_response_text),
-				"Braintree Payment Error",
-			)
-			self.integration_request.db_set("error", error_log.error, update_modified=False)
 		else:
-			self.integration_request.db_set("status", "Failed", update_modified=False)
-			for error in result.errors.deep_errors:
-				error_log = frappe.log_error(
-					"code: " + str(error.code) + " | message: " + str(error.message),
-					"Braintree Payment Error",
-				)
-				self.integration_request.db_set("error", error_log.error, update_modified=False)
+			if result.transaction:
+				errors = [
+					"code: "
+					+ str(result.transaction.processor_response_code)
+					+ " | text: "
+					+ str(result.transaction.processor_response_text)
+				]
+			else:
+				errors = [
+					"code: " + str(error.code) + " | message: " + str(error.message)
+					for error in result.errors.deep_errors
+				] or [str(result.message)]
+
+			error_log = frappe.log_error("\n".join(errors), "Braintree Payment Error")
+			self.integration_request.update_status({}, "Failed", fields={"error": error_log.error})
 
 		if self.flags.status_changed_to == "Completed":
 			status = "Completed"
@@ -311,6 +407,120 @@ class BraintreeSettings(PaymentGatewayController):
 
 		return {"redirect_to": redirect_url, "status": status}
 
+	def sync_settlement_status(self, from_date, to_date):
+		"""Update the settlement status of the transactions created between two dates"""
+		import braintree
+
+		transactions = self.gateway.transaction.search(
+			braintree.TransactionSearch.created_at.between(from_date, to_date),
+			braintree.TransactionSearch.status.in_list(
+				[
+					braintree.Transaction.Status.Settled,
+					braintree.Transaction.Status.SettlementDeclined,
+				]
+			),
+		)
+
+		settlement_status = {}
+		for transaction in transactions.items:
+			status = transaction.status
+			if transaction.disbursement_details and transaction.disbursement_details.disbursement_date:
+				status = "disbursed"
+
+			settlement_status.setdefault(status, []).append(transaction.id)
+
+		update_settlement_status(settlement_status)
+
+
+def refresh_merchant_account_index(settings=None):
+	for name in [settings] if settings else frappe.get_all("Braintree Settings", pluck="name"):
+		try:
+			frappe.get_doc("Braintree Settings", name).build_merchant_account_index()
+		except Exception:
+			frappe.log_error(_("Braintree merchant accounts could not be refreshed for {0}").format(name))
+
+
+def refill_client_token_pools():
+	for name in frappe.get_all("Braintree Settings", pluck="name"):
+		try:
+			settings = frappe.get_doc("Braintree Settings", name)
+			for merchant_account_id in set(settings.get_merchant_account_index().values()):
+				settings.refill_client_token_pool(merchant_account_id)
+		except Exception:
+			frappe.log_error(_("Braintree client tokens could not be generated for {0}").format(name))
+
+
+def sync_settlement_status():
+	to_date = now_datetime()
+	from_date = add_days(to_date, -SETTLEMENT_SWEEP_DAYS)
+
+	for name in frappe.get_all("Braintree Settings", pluck="name"):
+		try:
+			frappe.get_doc("Braintree Settings", name).sync_settlement_status(from_date, to_date)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(
+				_("Braintree settlement status could not be synchronized for {0}").format(name)
+			)
+
+
+def update_settlement_status(settlement_status):
+	"""Bulk update integration requests from a mapping of settlement status to transaction ids.
+
+	The settlement status is kept in `service_status`, `output` holds the transaction status.
+	"""
+	for status, transaction_ids in settlement_status.items():
+		for batch in create_batch(transaction_ids, 500):
+			# `get_all` also matches the requests without a settlement status yet
+			names = frappe.get_all(
+				"Integration Request",
+				filters={
+					"integration_request_service": "Braintree",
+					"service_id": ("in", batch),
+					"service_status": ("!=", status),
+				},
+				pluck="name",
+			)
+			if names:
+				frappe.db.set_value(
+					"Integration Request",
+					{"name": ("in", names)},
+					"service_status",
+					status,
+					update_modified=False,
+				)
+
+
+@frappe.whitelist(allow_guest=True)
+def webhooks(account=None):
+	"""Receive the transaction settlement and disbursement notifications sent by Braintree"""
+	if not account:
+		account = frappe.get_all("Braintree Settings", pluck="name", limit=1)
+		account = account[0] if account else None
+
+	try:
+		settings = frappe.get_doc("Braintree Settings", account)
+		notification = settings.gateway.webhook_notification.parse(
+			frappe.form_dict.get("bt_signature"), frappe.form_dict.get("bt_payload")
+		)
+	except Exception:
+		frappe.log_error(_("Braintree webhook notification could not be parsed"))
+		frappe.response.message = "Webhook notification parsing failed"
+		frappe.response.http_status_code = 400
+		return
+
+	if notification.kind in SETTLEMENT_WEBHOOK_KINDS:
+		update_settlement_status(
+			{SETTLEMENT_WEBHOOK_KINDS[notification.kind]: [notification.transaction.id]}
+		)
+	elif notification.kind == DISBURSEMENT_WEBHOOK_KIND:
+		update_settlement_status({"disbursed": notification.disbursement.transaction_ids})
+
+	frappe.response.message = "Webhook received and notification handled"
+	frappe.response.http_status_code = 200
+
+
 def get_gateway_controller(doc):
 	payment_request = frappe.get_doc("Payment Request", doc)
 	gateway_controller = frappe.db.get_value(
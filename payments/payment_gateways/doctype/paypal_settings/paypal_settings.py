@@ -62,22 +62,32 @@ More Details:
 
 """
 
-import json
-from urllib.parse import urlencode
+from urllib.parse import parse_qs, urlencode
 
 import frappe
 import pytz
 from frappe import _
-from frappe.integrations.utils import create_request_log, make_post_request
+from frappe.integrations.utils import create_request_log
 from frappe.model.document import Document
-from frappe.utils import call_hook_method, cint, get_datetime, get_url
+from frappe.utils import call_hook_method, cint, create_batch, get_datetime, get_url
 
-from payments.utils import create_payment_gateway
+from payments.payment_gateways.doctype.paypal_settings.rest_api import PayPalRestClient
+from payments.utils import codec, create_payment_gateway, create_request_logs
+from payments.utils.cache import clear_settings_version, get_process_cached_value
+from payments.utils.http import request, run_concurrently
 
 api_path = (
 	"/api/method/payments.payment_gateways.doctype.paypal_settings.paypal_settings"
 )
 
+# (connect, read) timeouts of the NVP API, in seconds
+NVP_API_TIMEOUT = (3.05, 30)
+
+# Concurrency of the bulk payment setup and recurring profile operations
+BULK_REQUEST_WORKERS = 10
+# Maximum number of bulk requests per second
+BULK_REQUEST_RATE_LIMIT = 10
+
 
 class PayPalSettings(Document):
 	supported_currencies = [
@@ -112,17 +122,19 @@ class PayPalSettings(Document):
 		setattr(self, "use_sandbox", 0)
 
 	def setup_sandbox_env(self, token):
-		data = json.loads(frappe.db.get_value("Integration Request", token, "data"))
-		setattr(self, "use_sandbox", cint(frappe._dict(data).use_sandbox) or 0)
+		setattr(self, "use_sandbox", get_sandbox_mode(token))
 
 	def validate(self):
 		create_payment_gateway("PayPal")
 		call_hook_method("payment_gateway_enabled", gateway="PayPal")
 		if not self.flags.ignore_mandatory:
-			self.validate_paypal_credentails()
+			if self.api_engine == "REST":
+				self.validate_rest_credentials()
+			else:
+				self.validate_paypal_credentails()
 
 	def on_update(self):
-		pass
+		clear_settings_version(self.doctype)
 
 	def validate_transaction_currency(self, currency):
 		if currency not in self.supported_currencies:
@@ -133,6 +145,9 @@ class PayPalSettings(Document):
 			)
 
 	def get_paypal_params_and_url(self):
+		return get_nvp_credentials(self.use_sandbox)
+
+	def build_paypal_params_and_url(self):
 		params = {
 			"USER": self.api_username,
 			"PWD": self.get_password(fieldname="api_password", raise_exception=False),
@@ -159,11 +174,11 @@ class PayPalSettings(Document):
 		return params, api_url
 
 	def validate_paypal_credentails(self):
-		params, url = self.get_paypal_params_and_url()
+		params, url = self.build_paypal_params_and_url()
 		params = urlencode(params)
 
 		try:
-			res = make_post_request(url=url, data=params.encode("utf-8"))
+			res = make_nvp_request(url, params.encode("utf-8"), idempotent=True)
 
 			if res["ACK"][0] == "Failure":
 				raise Exception
@@ -171,11 +186,118 @@ class PayPalSettings(Document):
 		except Exception:
 			frappe.throw(_("Invalid payment gateway credentials"))
 
+	def build_rest_client(self):
+		client_id = self.client_id
+		client_secret = self.get_password(fieldname="client_secret", raise_exception=False)
+
+		if self.use_sandbox:
+			client_id = frappe.conf.sandbox_client_id
+			client_secret = frappe.conf.sandbox_client_secret
+
+		return PayPalRestClient(
+			client_id, client_secret, sandbox=bool(self.paypal_sandbox or self.use_sandbox)
+		)
+
+	def validate_rest_credentials(self):
+		try:
+			self.build_rest_client().get_access_token(refresh=True)
+		except Exception:
+			frappe.throw(_("Invalid payment gateway credentials"))
+
 	def get_payment_url(self, **kwargs):
 		setattr(self, "use_sandbox", cint(kwargs.get("use_sandbox", 0)))
 
+		if self.api_engine == "REST":
+			return self.get_rest_payment_url(**kwargs)
+
 		response = self.execute_set_express_checkout(**kwargs)
 
+		kwargs.update(
+			{
+				"token": response.get("TOKEN")[0],
+				"correlation_id": response.get("CORRELATIONID")[0],
+			}
+		)
+
+		create_request_log(kwargs, service_name="PayPal", name=kwargs["token"])
+
+		return self.get_express_checkout_url(kwargs["token"])
+
+	def get_payment_urls(self, payment_details):
+		"""Set up the payments concurrently and insert their Integration Requests in batches"""
+		# Everything touching the database or the request is prepared before starting the threads
+		sandbox_modes = {}
+		setup_requests = {}
+		for kwargs in payment_details:
+			reference = kwargs["reference_docname"]
+			sandbox_modes[reference] = cint(kwargs.get("use_sandbox", 0))
+			setattr(self, "use_sandbox", sandbox_modes[reference])
+			if self.api_engine == "REST":
+				setup_requests[reference] = self.get_rest_setup_request(**kwargs)
+			else:
+				setup_requests[reference] = self.get_set_express_checkout_request(**kwargs)
+
+		if self.api_engine == "REST":
+			clients = {}
+			for use_sandbox in set(sandbox_modes.values()):
+				client = get_rest_client(use_sandbox)
+				clients[use_sandbox] = (client, client.get_access_token())
+
+			def _setup_payment(reference):
+				method, args = setup_requests[reference]
+				client, access_token = clients[sandbox_modes[reference]]
+				return getattr(client, method)(access_token=access_token, **args)
+
+		else:
+
+			def _setup_payment(reference):
+				return make_nvp_request(*setup_requests[reference])
+
+		responses = {}
+		failed_payments = []
+		for reference, response, error in run_concurrently(
+			_setup_payment,
+			list(setup_requests),
+			max_workers=BULK_REQUEST_WORKERS,
+			rate_limit=BULK_REQUEST_RATE_LIMIT,
+		):
+			if error or (self.api_engine != "REST" and response.get("ACK")[0] != "Success"):
+				failed_payments.append(f"{reference}: {error or response}")
+			else:
+				responses[reference] = response
+
+		if failed_payments:
+			frappe.log_error("\n".join(failed_payments), _("PayPal payment setup failed"))
+
+		logs = []
+		payment_urls = {}
+		for kwargs in payment_details:
+			reference = kwargs["reference_docname"]
+			response = responses.get(reference)
+			if not response:
+				payment_urls[reference] = None
+				continue
+
+			if self.api_engine == "REST":
+				kwargs.update({"token": response.get("id")})
+				payment_urls[reference] = PayPalRestClient.get_approval_url(response)
+			else:
+				kwargs.update(
+					{
+						"token": response.get("TOKEN")[0],
+						"correlation_id": response.get("CORRELATIONID")[0],
+					}
+				)
+				setattr(self, "use_sandbox", sandbox_modes[reference])
+				payment_urls[reference] = self.get_express_checkout_url(kwargs["token"])
+
+			logs.append(kwargs)
+
+		create_request_logs(logs, service_name="PayPal", names=[kwargs["token"] for kwargs in logs])
+
+		return payment_urls
+
+	def get_express_checkout_url(self, token):
 		if self.paypal_sandbox or self.use_sandbox:
 			return_url = (
 				"https://www.sandbox.paypal.com/cgi-bin/webscr?cmd=_express-checkout&token={0}"
@@ -183,18 +305,51 @@ class PayPalSettings(Document):
 		else:
 			return_url = "https://www.paypal.com/cgi-bin/webscr?cmd=_express-checkout&token={0}"
 
-		kwargs.update(
-			{
-				"token": response.get("TOKEN")[0],
-				"correlation_id": response.get("CORRELATIONID")[0],
-			}
-		)
+		return return_url.format(token)
+
+	def get_rest_payment_url(self, **kwargs):
+		client = get_rest_client(self.use_sandbox)
+		method, args = self.get_rest_setup_request(**kwargs)
+		response = getattr(client, method)(**args)
 
+		kwargs.update({"token": response.get("id")})
 		create_request_log(kwargs, service_name="PayPal", name=kwargs["token"])
 
-		return return_url.format(kwargs["token"])
+		return client.get_approval_url(response)
+
+	def get_rest_setup_request(self, **kwargs):
+		"""Returns the client method creating the order and its arguments"""
+		if kwargs.get("subscription_details"):
+			# REST subscriptions would need PayPal webhooks for their renewals
+			frappe.throw(
+				_(
+					"Subscriptions are not supported by the PayPal REST API. Please select the NVP API in PayPal Settings."
+				)
+			)
+
+		request_id = frappe.generate_hash(length=20)
+
+		return "create_order", dict(
+			amount=kwargs["amount"],
+			currency=kwargs["currency"].upper(),
+			return_url=get_url(f"{api_path}.confirm_order"),
+			cancel_url=get_url("/payment-cancel"),
+			request_id=request_id,
+			description=(kwargs.get("description") or "")[:127],
+		)
 
 	def execute_set_express_checkout(self, **kwargs):
+		response = make_nvp_request(*self.get_set_express_checkout_request(**kwargs))
+
+		if response.get("ACK")[0] != "Success":
+			frappe.throw(
+				_("Looks like something is wrong with this site's Paypal configuration.")
+			)
+
+		return response
+
+	def get_set_express_checkout_request(self, **kwargs):
+		"""Returns the url and encoded parameters of a SetExpressCheckout call"""
 		params, url = self.get_paypal_params_and_url()
 
 		params.update(
@@ -211,15 +366,7 @@ class PayPalSettings(Document):
 		if kwargs.get("subscription_details"):
 			self.configure_recurring_payments(params, kwargs)
 
-		params = urlencode(params)
-		response = make_post_request(url, data=params.encode("utf-8"))
-
-		if response.get("ACK")[0] != "Success":
-			frappe.throw(
-				_("Looks like something is wrong with this site's Paypal configuration.")
-			)
-
-		return response
+		return url, urlencode(params).encode("utf-8")
 
 	def configure_recurring_payments(self, params, kwargs):
 		# removing the params as we have to setup rucurring payments
@@ -238,13 +385,66 @@ class PayPalSettings(Document):
 		)
 
 
-def get_paypal_and_transaction_details(token):
-	doc = frappe.get_doc("PayPal Settings")
-	doc.setup_sandbox_env(token)
-	params, url = doc.get_paypal_params_and_url()
+def get_nvp_credentials(use_sandbox=0):
+	"""Returns the NVP API parameters and url, cached in the process until PayPal Settings are modified"""
+	use_sandbox = cint(use_sandbox)
 
-	integration_request = frappe.get_doc("Integration Request", token)
-	data = json.loads(integration_request.data)
+	def _get_credentials():
+		doc = frappe.get_doc("PayPal Settings")
+		setattr(doc, "use_sandbox", use_sandbox)
+		return doc.build_paypal_params_and_url()
+
+	params, url = get_process_cached_value(
+		"PayPal Settings", None, f"nvp_credentials:{use_sandbox}", _get_credentials
+	)
+
+	return dict(params), url
+
+
+def get_integration_request(token):
+	"""Returns the Integration Request of a PayPal token with its decoded data.
+
+	Both are loaded once per request and shared by the helpers of the redirect steps.
+	"""
+	key = f"paypal_integration_request:{token}"
+	if key not in frappe.local.cache:
+		doc = frappe.get_doc("Integration Request", token)
+		frappe.local.cache[key] = (doc, frappe._dict(codec.loads(doc.data)))
+
+	return frappe.local.cache[key]
+
+
+def get_rest_client(use_sandbox=0):
+	"""Returns a REST API client, cached in the process until PayPal Settings are modified"""
+	use_sandbox = cint(use_sandbox)
+
+	def _get_client():
+		doc = frappe.get_doc("PayPal Settings")
+		setattr(doc, "use_sandbox", use_sandbox)
+		return doc.build_rest_client()
+
+	return get_process_cached_value("PayPal Settings", None, f"rest_client:{use_sandbox}", _get_client)
+
+
+def get_sandbox_mode(token):
+	doc, data = get_integration_request(token)
+	return cint(data.use_sandbox) or 0
+
+
+def make_nvp_request(url, data, idempotent=False):
+	"""Post a request to the NVP API through the pooled transport and parse the response.
+
+	Set `idempotent` for read-only methods, so that they are retried on transient errors.
+	"""
+	response = request("POST", url, data=data, timeout=NVP_API_TIMEOUT, idempotent=idempotent)
+	response.raise_for_status()
+
+	return parse_qs(response.text)
+
+
+def get_paypal_and_transaction_details(token):
+	params, url = get_nvp_credentials(get_sandbox_mode(token))
+	integration_request, data = get_integration_request(token)
 
 	return data, params, url
 
@@ -270,13 +470,10 @@ def setup_redirect(data, redirect_url, custom_redirect_to=None, redirect=True):
 @frappe.whitelist(allow_guest=True, xss_safe=True)
 def get_express_checkout_details(token):
 	try:
-		doc = frappe.get_doc("PayPal Settings")
-		doc.setup_sandbox_env(token)
-
-		params, url = doc.get_paypal_params_and_url()
+		params, url = get_nvp_credentials(get_sandbox_mode(token))
 		params.update({"METHOD": "GetExpressCheckoutDetails", "TOKEN": token})
 
-		response = make_post_request(url, data=params)
+		response = make_nvp_request(url, params, idempotent=True)
 
 		if response.get("ACK")[0] != "Success":
 			frappe.respond_as_web_page(
@@ -290,18 +487,14 @@ def get_express_checkout_details(token):
 
 			return
 
-		doc = frappe.get_doc("Integration Request", token)
 		update_integration_request_status(
 			token,
 			{"payerid": response.get("PAYERID")[0], "payer_email": response.get("EMAIL")[0]},
 			"Authorized",
-			doc=doc,
 		)
 
 		frappe.local.response["type"] = "redirect"
-		frappe.local.response["location"] = get_redirect_uri(
-			doc, token, response.get("PAYERID")[0]
-		)
+		frappe.local.response["location"] = get_redirect_uri(token, response.get("PAYERID")[0])
 
 	except Exception:
 		frappe.log_error(frappe.get_traceback())
@@ -324,10 +517,11 @@ def confirm_payment(token):
 			}
 		)
 
-		response = make_post_request(url, data=params)
+		response = make_nvp_request(url, params)
 
 		if response.get("ACK")[0] == "Success":
-			update_integration_request_status(
+			# The payment hooks only run once, when the request is completed
+			status_changed = update_integration_request_status(
 				token,
 				{
 					"transaction_id": response.get("PAYMENTINFO_0_TRANSACTIONID")[0],
@@ -336,7 +530,7 @@ def confirm_payment(token):
 				"Completed",
 			)
 
-			if data.get("reference_doctype") and data.get("reference_docname"):
+			if status_changed and data.get("reference_doctype") and data.get("reference_docname"):
 				custom_redirect_to = frappe.get_doc(
 					data.get("reference_doctype"), data.get("reference_docname")
 				).run_method("on_payment_authorized", "Completed")
@@ -401,10 +595,10 @@ def create_recurring_profile(token, payerid):
 		# "PROFILESTARTDATE": datetime.utcfromtimestamp(get_timestamp(starts_at)).isoformat()
 		params.update({"PROFILESTARTDATE": starts_at.isoformat()})
 
-		response = make_post_request(url, data=params)
+		response = make_nvp_request(url, params)
 
 		if response.get("ACK")[0] == "Success":
-			update_integration_request_status(
+			status_changed = update_integration_request_status(
 				token,
 				{
 					"profile_id": response.get("PROFILEID")[0],
@@ -412,7 +606,7 @@ def create_recurring_profile(token, payerid):
 				"Completed",
 			)
 
-			if data.get("reference_doctype") and data.get("reference_docname"):
+			if status_changed and data.get("reference_doctype") and data.get("reference_docname"):
 				data["subscription_id"] = response.get("PROFILEID")[0]
 
 				frappe.flags.data = data
@@ -433,15 +627,51 @@ def create_recurring_profile(token, payerid):
 		frappe.log_error(frappe.get_traceback())
 
 
+@frappe.whitelist(allow_guest=True, xss_safe=True)
+def confirm_order(token):
+	"""Return url of REST checkout orders: captures the approved order"""
+	try:
+		custom_redirect_to = None
+		integration_request, data = get_integration_request(token)
+
+		order = get_rest_client(data.use_sandbox).capture_order(token)
+
+		if order.get("status") == "COMPLETED":
+			capture = order["purchase_units"][0]["payments"]["captures"][0]
+			status_changed = update_integration_request_status(
+				token, {"transaction_id": capture.get("id")}, "Completed"
+			)
+
+			if status_changed and data.get("reference_doctype") and data.get("reference_docname"):
+				custom_redirect_to = frappe.get_doc(
+					data.get("reference_doctype"), data.get("reference_docname")
+				).run_method("on_payment_authorized", "Completed")
+				frappe.db.commit()
+
+			redirect_url = "payment-success?doctype={}&docname={}".format(
+				data.get("reference_doctype"), data.get("reference_docname")
+			)
+		else:
+			redirect_url = "payment-failed"
+
+		setup_redirect(data, redirect_url, custom_redirect_to)
+
+	except Exception:
+		frappe.log_error(frappe.get_traceback())
+
+
 def update_integration_request_status(token, data, status, error=False, doc=None):
+	"""Returns True if the status was changed, see `update_status`"""
 	if not doc:
-		doc = frappe.get_doc("Integration Request", token)
+		doc, cached_data = get_integration_request(token)
+		# Keep the request-scoped copy in sync without decoding the document again
+		cached_data.update(data)
 
-	doc.update_status(data, status)
+	return doc.update_status(data, status)
 
 
-def get_redirect_uri(doc, token, payerid):
-	data = json.loads(doc.data)
+def get_redirect_uri(token, payerid):
+	doc, data = get_integration_request(token)
 
 	if data.get("subscription_details") or data.get("subscription_id"):
 		return get_url(f"{api_path}.create_recurring_profile?token={token}&payerid={payerid}")
@@ -450,6 +680,13 @@ def get_redirect_uri(doc, token, payerid):
 
 
 def manage_recurring_payment_profile_status(profile_id, action, args, url):
+	response = post_profile_action(profile_id, action, args, url)
+
+	if not is_profile_action_successful(response):
+		frappe.throw(_("Failed while amending subscription"))
+
+
+def post_profile_action(profile_id, action, args, url):
 	args.update(
 		{
 			"METHOD": "ManageRecurringPaymentsProfileStatus",
@@ -458,16 +695,124 @@ def manage_recurring_payment_profile_status(profile_id, action, args, url):
 		}
 	)
 
-	response = make_post_request(url, data=args)
+	return make_nvp_request(url, args)
+
 
+def is_profile_action_successful(response):
 	# error code 11556 indicates profile is not in active state(or already cancelled)
 	# thus could not cancel the subscription.
 	# thus raise an exception only if the error code is not equal to 11556
+	return (
+		response.get("ACK")[0] == "Success" or response.get("L_ERRORCODE0", [None])[0] == "11556"
+	)
+
+
+@frappe.whitelist()
+def bulk_manage_recurring_profiles(profile_ids, action):
+	"""Cancel, suspend or reactivate many recurring profiles in parallel.
+
+	Returns the result of each profile: {profile_id: {"success": bool, "message": str}}
+	"""
+	frappe.only_for("System Manager")
+
+	if action not in ("Cancel", "Suspend", "Reactivate"):
+		frappe.throw(_("Invalid action: {0}").format(action))
+
+	if isinstance(profile_ids, str):
+		profile_ids = frappe.parse_json(profile_ids)
+
+	params, url = get_nvp_credentials()
 
-	if (
-		response.get("ACK")[0] != "Success" and response.get("L_ERRORCODE0", [])[0] != "11556"
+	def _manage(profile_id):
+		return post_profile_action(profile_id, action, dict(params), url)
+
+	results = {}
+	for profile_id, response, error in run_concurrently(
+		_manage,
+		profile_ids,
+		max_workers=BULK_REQUEST_WORKERS,
+		rate_limit=BULK_REQUEST_RATE_LIMIT,
 	):
-		frappe.throw(_("Failed while amending subscription"))
+		if error:
+			results[profile_id] = {"success": False, "message": str(error)}
+		elif is_profile_action_successful(response):
+			results[profile_id] = {"success": True, "message": response.get("ACK")[0]}
+		else:
+			results[profile_id] = {
+				"success": False,
+				"message": response.get("L_LONGMESSAGE0", response.get("ACK"))[0],
+			}
+
+	return results
+
+
+def get_recurring_profiles():
+	"""Returns the known recurring profiles, mapped to the names of their integration requests"""
+	profiles = {}
+	for request in frappe.get_all(
+		"Integration Request",
+		filters={
+			"integration_request_service": "PayPal",
+			"status": "Completed",
+			"recurring_profile_id": ("is", "set"),
+		},
+		fields=["name", "recurring_profile_id"],
+	):
+		profiles.setdefault(request.recurring_profile_id, []).append(request.name)
+
+	return profiles
+
+
+def sync_recurring_profiles():
+	"""Store the current status of every known recurring profile in its integration requests.
+
+	Recurring profiles are only created with the NVP API: they keep being synchronized
+	with the NVP credentials after switching to the REST API.
+	"""
+	if not frappe.db.get_single_value("PayPal Settings", "api_username"):
+		return
+
+	profiles = get_recurring_profiles()
+	if not profiles:
+		return
+
+	params, url = get_nvp_credentials()
+
+	def _get_profile_details(profile_id):
+		return make_nvp_request(
+			url,
+			dict(params, METHOD="GetRecurringPaymentsProfileDetails", PROFILEID=profile_id),
+			idempotent=True,
+		)
+
+	profile_status = {}
+	failed_profiles = []
+	for profile_id, response, error in run_concurrently(
+		_get_profile_details,
+		list(profiles),
+		max_workers=BULK_REQUEST_WORKERS,
+		rate_limit=BULK_REQUEST_RATE_LIMIT,
+	):
+		if error or response.get("ACK")[0] != "Success":
+			failed_profiles.append(profile_id)
+			continue
+
+		profile_status.setdefault(response.get("STATUS")[0], []).extend(profiles[profile_id])
+
+	for status, names in profile_status.items():
+		for batch in create_batch(names, 500):
+			frappe.db.set_value(
+				"Integration Request",
+				{"name": ("in", batch)},
+				"service_status",
+				status,
+				update_modified=False,
+			)
+
+	if failed_profiles:
+		frappe.log_error(
+			"\n".join(failed_profiles), _("PayPal recurring profiles could not be synchronized")
+		)
 
 
 @frappe.whitelist(allow_guest=True)
@@ -475,14 +820,18 @@ def ipn_handler():
 	try:
 		data = frappe.local.form_dict
 
-		validate_ipn_request(data)
+		# The recurring profile is checked with PayPal in the background job,
+		# so that the IPN is acknowledged without waiting for PayPal
+		if not data.get("recurring_payment_id"):
+			return
 
 		data.update({"payment_gateway": "PayPal"})
 
 		doc = frappe.get_doc(
 			{
-				"data": json.dumps(frappe.local.form_dict),
+				"data": codec.dumps(frappe.local.form_dict),
 				"doctype": "Integration Request",
+				"integration_request_service": "PayPal",
 				"request_description": "Subscription Notification",
 				"is_remote_request": 1,
 				"status": "Queued",
@@ -498,8 +847,6 @@ def ipn_handler():
 			**{"doctype": "Integration Request", "docname": doc.name},
 		)
 
-	except frappe.InvalidStatusError:
-		pass
 	except Exception as e:
 		frappe.log(frappe.log_error(title=e))
 
@@ -511,8 +858,7 @@ def validate_ipn_request(data):
 	if not data.get("recurring_payment_id"):
 		_throw()
 
-	doc = frappe.get_doc("PayPal Settings")
-	params, url = doc.get_paypal_params_and_url()
+	params, url = get_nvp_credentials()
 
 	params.update(
 		{
@@ -522,11 +868,74 @@ def validate_ipn_request(data):
 	)
 
 	params = urlencode(params)
-	res = make_post_request(url=url, data=params.encode("utf-8"))
+	res = make_nvp_request(url, params.encode("utf-8"), idempotent=True)
 
 	if res["ACK"][0] != "Success":
 		_throw()
 
 
 def handle_subscription_notification(doctype, docname):
-	call_hook_method("handle_subscription_notification", doctype=doctype, docname=docname)
+	doc = frappe.get_doc(doctype, docname)
+
+	try:
+		validate_ipn_request(codec.loads(doc.data))
+	except frappe.InvalidStatusError:
+		doc.update_status({}, "Failed", fields={"error": _("Invalid recurring payment profile")})
+		return
+	except Exception:
+		# Keep the notification queued: it is validated again by retry_subscription_notifications
+		doc.db_set("error", frappe.get_traceback())
+		return
+
+	process_subscription_notification(doc)
+
+
+def process_subscription_notification(doc):
+	if doc.error:
+		doc.db_set("error", None)
+
+	call_hook_method("handle_subscription_notification", doctype=doc.doctype, docname=doc.name)
+
+
+def retry_subscription_notifications():
+	"""Validate again the notifications for which PayPal could not be reached.
+
+	Notifications are grouped by recurring profile, so each profile is checked once.
+	"""
+	notifications = frappe.get_all(
+		"Integration Request",
+		filters={
+			"integration_request_service": "PayPal",
+			"request_description": "Subscription Notification",
+			"status": "Queued",
+			"error": ("is", "set"),
+		},
+		fields=["name", "data"],
+		order_by="creation asc",
+	)
+
+	profiles = {}
+	for notification in notifications:
+		profile_id = codec.loads(notification.data).get("recurring_payment_id")
+		profiles.setdefault(profile_id, []).append(notification.name)
+
+	for profile_id, names in profiles.items():
+		try:
+			validate_ipn_request({"recurring_payment_id": profile_id})
+		except frappe.InvalidStatusError:
+			for name in names:
+				frappe.get_doc("Integration Request", name).update_status(
+					{}, "Failed", fields={"error": _("Invalid recurring payment profile")}
+				)
+			continue
+		except Exception:
+			frappe.log_error(_("PayPal recurring profile {0} could not be validated").format(profile_id))
+			continue
+
+		for name in names:
+			try:
+				process_subscription_notification(frappe.get_doc("Integration Request", name))
+				frappe.db.commit()
+			except Exception:
+				frappe.db.rollback()
+				frappe.log_error(_("PayPal subscription notification {0} failed").format(name))
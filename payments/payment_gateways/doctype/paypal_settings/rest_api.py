@@ -0,0 +1,127 @@
+# Copyright (c) 2026, Dokos SAS and contributors
+# For license information, please see license.txt
+
+from hashlib import sha224
+
+import frappe
+from frappe.utils import cint, flt
+
+from payments.utils.http import request
+
+# (connect, read) timeouts of the REST API, in seconds
+API_TIMEOUT = (3.05, 30)
+
+# Access tokens are renewed slightly before PayPal expires them
+ACCESS_TOKEN_EXPIRY_MARGIN = 60
+
+# Currencies whose amounts PayPal only accepts without decimals
+ZERO_DECIMAL_CURRENCIES = ("HUF", "JPY", "TWD")
+
+
+class PayPalRestClient:
+	"""Client for the PayPal REST API (Orders v2).
+
+	The OAuth access token is shared by every process through the site cache
+	and renewed when it expires or is rejected by PayPal.
+	"""
+
+	def __init__(self, client_id, client_secret, sandbox=False):
+		self.client_id = client_id
+		self.client_secret = client_secret
+		self.base_url = "https://api-m.sandbox.paypal.com" if sandbox else "https://api-m.paypal.com"
+
+	@property
+	def access_token_key(self):
+		return f"paypal_access_token:{sha224(frappe.safe_encode(self.base_url + self.client_id)).hexdigest()}"
+
+	def get_access_token(self, refresh=False):
+		access_token = None if refresh else frappe.cache().get_value(self.access_token_key, expires=True)
+
+		if not access_token:
+			url = f"{self.base_url}/v1/oauth2/token"
+			# Requesting a new token has no side effect: it can be retried safely
+			response = request(
+				"POST",
+				url,
+				data={"grant_type": "client_credentials"},
+				auth=(self.client_id, self.client_secret),
+				timeout=API_TIMEOUT,
+				idempotent=True,
+			)
+			response.raise_for_status()
+			result = response.json()
+
+			access_token = result["access_token"]
+			frappe.cache().set_value(
+				self.access_token_key,
+				access_token,
+				expires_in_sec=max(cint(result.get("expires_in")) - ACCESS_TOKEN_EXPIRY_MARGIN, 1),
+			)
+
+		return access_token
+
+	def request(self, method, path, data=None, request_id=None, access_token=None):
+		"""Send a request to the API.
+
+		Requests with a PayPal-Request-Id are retried by the transport, PayPal deduplicates them.
+		Pass an `access_token` obtained beforehand to call the API from a worker thread:
+		the site cache is then not used, and the token is not renewed if it is rejected.
+		"""
+		url = f"{self.base_url}{path}"
+		headers = {"Content-Type": "application/json", "Prefer": "return=representation"}
+		if request_id:
+			headers["PayPal-Request-Id"] = request_id
+
+		response = None
+		for refresh in (False, True):
+			headers["Authorization"] = f"Bearer {access_token or self.get_access_token(refresh=refresh)}"
+			response = request(method, url, json=data, headers=headers, timeout=API_TIMEOUT)
+
+			# The token may have been revoked before its expiry
+			if response.status_code != 401 or access_token:
+				break
+
+		response.raise_for_status()
+		return response.json() if response.content else {}
+
+	def create_order(
+		self, amount, currency, return_url, cancel_url, request_id=None, access_token=None, **kwargs
+	):
+		# PayPal rejects empty strings, like an empty description
+		purchase_unit = {key: value for key, value in kwargs.items() if value not in (None, "")}
+		purchase_unit["amount"] = {
+			"currency_code": currency,
+			"value": self.format_amount(amount, currency),
+		}
+
+		return self.request(
+			"POST",
+			"/v2/checkout/orders",
+			data={
+				"intent": "CAPTURE",
+				"purchase_units": [purchase_unit],
+				"application_context": {
+					"return_url": return_url,
+					"cancel_url": cancel_url,
+					"user_action": "PAY_NOW",
+				},
+			},
+			request_id=request_id,
+			access_token=access_token,
+		)
+
+	def capture_order(self, order_id):
+		return self.request(
+			"POST", f"/v2/checkout/orders/{order_id}/capture", request_id=f"capture:{order_id}"
+		)
+
+	@staticmethod
+	def format_amount(amount, currency):
+		precision = 0 if currency in ZERO_DECIMAL_CURRENCIES else 2
+		return "{0:.{1}f}".format(flt(amount), precision)
+
+	@staticmethod
+	def get_approval_url(response):
+		for link in response.get("links", []):
+			if link.get("rel") in ("approve", "payer-action"):
+				return link.get("href")
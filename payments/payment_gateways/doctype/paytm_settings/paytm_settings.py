@@ -1,26 +1,48 @@
 # Copyright (c) 2020, Frappe Technologies and contributors
 # License: MIT. See LICENSE
 
-import json
 from urllib.parse import urlencode
 
 import frappe
 import requests
 from frappe import _
-from frappe.integrations.utils import create_request_log
 from frappe.model.document import Document
 from frappe.utils import (
+	add_to_date,
 	call_hook_method,
 	cint,
+	create_batch,
 	cstr,
 	flt,
 	get_request_site_address,
 	get_url,
+	now_datetime,
 )
 from frappe.utils.password import get_decrypted_password
-from paytmchecksum import generateSignature, verifySignature
 
-from payments.utils import create_payment_gateway
+from payments.utils import codec, create_payment_gateway, create_request_logs
+from payments.utils.cache import (
+	clear_settings_version,
+	get_process_cached_value,
+	get_settings_version,
+)
+from payments.utils.checkout import create_checkout_session, get_checkout_request
+from payments.utils.http import MAX_RETRIES, request, run_concurrently
+
+# Signed checkout parameters are reused when the checkout page is reloaded within this delay
+CHECKOUT_PARAMS_EXPIRY = 15 * 60
+
+# (connect, read) timeouts of the transaction status API, in seconds.
+# The payer's callback request waits for this call, so it is kept short.
+STATUS_API_TIMEOUT = (3.05, 5)
+DEFERRED_STATUS_API_TIMEOUT = (3.05, 30)
+
+# Orders still pending after this delay (in minutes) are reconciled by the scheduler
+STALE_ORDER_DELAY = 30
+RECONCILIATION_BATCH_SIZE = 500
+RECONCILIATION_WORKERS = 8
+# Maximum number of status queries per second sent by the reconciliation
+RECONCILIATION_RATE_LIMIT = 10
 
 
 class PaytmSettings(Document):
@@ -30,6 +52,9 @@ class PaytmSettings(Document):
 		create_payment_gateway("Paytm")
 		call_hook_method("payment_gateway_enabled", gateway="Paytm")
 
+	def on_update(self):
+		clear_settings_version(self.doctype)
+
 	def validate_transaction_currency(self, currency):
 		if currency not in self.supported_currencies:
 			frappe.throw(
@@ -41,15 +66,30 @@ class PaytmSettings(Document):
 	def get_payment_url(self, **kwargs):
 		"""Return payment url with several params"""
 		# create unique order id by making it equal to the integration request
-		integration_request = create_request_log(kwargs, service_name="Paytm")
-		kwargs.update(dict(order_id=integration_request.name))
+		kwargs.update(dict(order_id=create_checkout_session(kwargs, service_name="Paytm")))
 
 		return get_url(f"./paytm_checkout?{urlencode(kwargs)}")
 
+	def get_payment_urls(self, payment_details):
+		names = create_request_logs(payment_details, service_name="Paytm")
+		return {
+			details["reference_docname"]: get_url(
+				f"./paytm_checkout?{urlencode(dict(details, order_id=name))}"
+			)
+			for name, details in zip(names, payment_details)
+		}
+
 
 def get_paytm_config():
 	"""Returns paytm config"""
 
+	# Cached in the process until Paytm Settings are modified
+	return frappe._dict(
+		get_process_cached_value("Paytm Settings", None, "config", _get_paytm_config)
+	)
+
+
+def _get_paytm_config():
 	paytm_config = frappe.db.get_singles_dict("Paytm Settings")
 	paytm_config.update(
 		dict(
@@ -78,7 +118,22 @@ def get_paytm_config():
 	return paytm_config
 
 
+def get_paytm_checkout_params(order_id, paytm_config):
+	"""Returns the signed checkout parameters of an order, cached until they expire"""
+	key = f"paytm_checkout_params:{order_id}:{get_settings_version('Paytm Settings')}"
+
+	paytm_params = frappe.cache().get_value(key)
+	if not paytm_params:
+		# The checkout page submits the order to Paytm: the payment is being attempted
+		doc = get_checkout_request(order_id)
+		paytm_params = get_paytm_params(codec.loads(doc.data), doc.name, paytm_config)
+		frappe.cache().set_value(key, paytm_params, expires_in_sec=CHECKOUT_PARAMS_EXPIRY)
+
+	return paytm_params
+
+
 def get_paytm_params(payment_details, order_id, paytm_config):
+	from paytmchecksum import generateSignature
 
 	# initialize a dictionary
 	paytm_params = dict()
@@ -119,6 +174,8 @@ def verify_transaction(**paytm_params):
 	paytm_checksum = paytm_params.pop("CHECKSUMHASH", None)
 
 	if paytm_params and paytm_config and paytm_checksum:
+		from paytmchecksum import verifySignature
+
 		# Verify checksum
 		is_valid_checksum = verifySignature(
 			paytm_params, paytm_config.merchant_key, paytm_checksum
@@ -140,53 +197,179 @@ def verify_transaction(**paytm_params):
 
 def verify_transaction_status(paytm_config, order_id):
 	"""Verify transaction completion after checksum has been verified"""
+	try:
+		response = get_transaction_status(paytm_config, order_id)
+	except requests.exceptions.Timeout:
+		defer_transaction_verification(order_id)
+		return
+
+	finalize_request(order_id, response)
+
+
+def get_transaction_status(paytm_config, order_id, timeout=STATUS_API_TIMEOUT, retries=0):
+	return post_transaction_status_request(
+		paytm_config.transaction_status_url,
+		get_transaction_status_payload(paytm_config, order_id),
+		timeout=timeout,
+		retries=retries,
+	)
+
+
+def get_transaction_status_payload(paytm_config, order_id):
+	from paytmchecksum import generateSignature
+
 	paytm_params = dict(MID=paytm_config.merchant_id, ORDERID=order_id)
 
 	checksum = generateSignature(paytm_params, paytm_config.merchant_key)
 	paytm_params["CHECKSUMHASH"] = checksum
 
-	post_data = json.dumps(paytm_params)
-	url = paytm_config.transaction_status_url
+	return codec.dumps(paytm_params)
+
 
-	response = requests.post(
-		url, data=post_data, headers={"Content-type": "application/json"}
+def post_transaction_status_request(url, post_data, timeout=STATUS_API_TIMEOUT, retries=0):
+	# The status query is read-only: it is safe to replay when retries are allowed
+	return request(
+		"POST",
+		url,
+		data=post_data,
+		headers={"Content-type": "application/json"},
+		timeout=timeout,
+		retries=retries,
+		idempotent=True,
 	).json()
-	finalize_request(order_id, response)
+
+
+def defer_transaction_verification(order_id):
+	"""Verify the transaction in the background when Paytm is too slow to answer"""
+	request = frappe.get_doc("Integration Request", order_id)
+	if request.update_status({}, "Authorized"):
+		frappe.enqueue(
+			method="payments.payment_gateways.doctype.paytm_settings.paytm_settings.verify_deferred_transaction",
+			queue="short",
+			enqueue_after_commit=True,
+			order_id=order_id,
+		)
+
+	elif request.status in ("Completed", "Failed"):
+		# Finalized in the meantime by the reconciliation of pending orders
+		frappe.local.response["type"] = "redirect"
+		frappe.local.response["location"] = (
+			"payment-success" if request.status == "Completed" else "payment-failed"
+		)
+		return
+
+	frappe.respond_as_web_page(
+		_("Payment Pending"),
+		_("Your payment is being verified. You will be notified as soon as it is confirmed."),
+		http_status_code=202,
+		indicator_color="orange",
+	)
+
+
+def verify_deferred_transaction(order_id):
+	response = get_transaction_status(
+		get_paytm_config(), order_id, timeout=DEFERRED_STATUS_API_TIMEOUT, retries=MAX_RETRIES
+	)
+	complete_request(order_id, response)
+
+
+def reconcile_pending_orders():
+	"""Finalize the orders whose payer never came back to the callback url"""
+	paytm_config = get_paytm_config()
+	if not paytm_config.merchant_id:
+		return
+
+	orders = frappe.get_all(
+		"Integration Request",
+		filters={
+			"integration_request_service": "Paytm",
+			"status": ("in", ("Queued", "Authorized")),
+			"creation": ("<", add_to_date(now_datetime(), minutes=-STALE_ORDER_DELAY)),
+		},
+		order_by="creation asc",
+		pluck="name",
+	)
+
+	url = paytm_config.transaction_status_url
+	for batch in create_batch(orders, RECONCILIATION_BATCH_SIZE):
+		# Sign every query before sending them, the threads only make the HTTP calls
+		payloads = {
+			order_id: get_transaction_status_payload(paytm_config, order_id) for order_id in batch
+		}
+
+		def _get_status(order_id):
+			return post_transaction_status_request(
+				url, payloads[order_id], timeout=DEFERRED_STATUS_API_TIMEOUT, retries=MAX_RETRIES
+			)
+
+		for order_id, response, error in run_concurrently(
+			_get_status,
+			batch,
+			max_workers=RECONCILIATION_WORKERS,
+			rate_limit=RECONCILIATION_RATE_LIMIT,
+		):
+			if error:
+				frappe.log_error(
+					f"{order_id}: {error}", _("Paytm order status could not be retrieved")
+				)
+				continue
+
+			if response.get("STATUS") == "PENDING":
+				continue
+
+			try:
+				complete_request(order_id, response)
+				frappe.db.commit()
+			except Exception:
+				frappe.db.rollback()
+				frappe.log_error(_("Paytm order {0} could not be reconciled").format(order_id))
 
 
 def finalize_request(order_id, transaction_response):
+	redirect_url = complete_request(order_id, transaction_response)
+
+	frappe.local.response["type"] = "redirect"
+	frappe.local.response["location"] = redirect_url
+
+
+def complete_request(order_id, transaction_response):
+	"""Update the integration request and its reference document and return the redirect url"""
 	request = frappe.get_doc("Integration Request", order_id)
-	transaction_data = frappe._dict(json.loads(request.data))
+	transaction_data = frappe._dict(codec.loads(request.data))
 	redirect_to = transaction_data.get("redirect_to") or None
 	redirect_message = transaction_data.get("redirect_message") or None
 
+	# Only the worker finalizing the request runs the payment hooks: the callback, the deferred
+	# verification and the reconciliation can all complete the same order
 	if transaction_response["STATUS"] == "TXN_SUCCESS":
-		if transaction_data.reference_doctype and transaction_data.reference_docname:
+		if (
+			request.update_status({}, "Completed")
+			and transaction_data.reference_doctype
+			and transaction_data.reference_docname
+		):
 			custom_redirect_to = None
 			try:
 				custom_redirect_to = frappe.get_doc(
 					transaction_data.reference_doctype, transaction_data.reference_docname
 				).run_method("on_payment_authorized", "Completed")
-				request.db_set("status", "Completed")
 			except Exception:
-				request.db_set("status", "Failed")
+				request.db_set("error", frappe.get_traceback())
 				frappe.log_error(frappe.get_traceback())
 
 			if custom_redirect_to:
 				redirect_to = custom_redirect_to
 
-			redirect_url = "payment-success"
 	else:
-		request.db_set("status", "Failed")
-		redirect_url = "payment-failed"
+		request.update_status({}, "Failed")
+
+	redirect_url = "payment-success" if request.status == "Completed" else "payment-failed"
 
 	if redirect_to:
 		redirect_url += "?" + urlencode({"redirect_to": redirect_to})
 	if redirect_message:
 		redirect_url += "&" + urlencode({"redirect_message": redirect_message})
 
-	frappe.local.response["type"] = "redirect"
-	frappe.local.response["location"] = redirect_url
+	return redirect_url
 
 
 def get_gateway_controller(doctype, docname):
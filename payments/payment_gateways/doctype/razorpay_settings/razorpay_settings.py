@@ -61,21 +61,18 @@ For razorpay payment status is Authorized
 
 import hashlib
 import hmac
-import json
 from urllib.parse import urlencode
 
 import frappe
-import razorpay
 from frappe import _
-from frappe.integrations.utils import (
-	create_request_log,
-	make_get_request,
-	make_post_request,
-)
+from frappe.integrations.utils import create_request_log
 from frappe.model.document import Document
 from frappe.utils import call_hook_method, cint, get_timestamp, get_url
 
-from payments.utils import create_payment_gateway
+from payments.utils import codec, create_payment_gateway, create_request_logs
+from payments.utils.cache import clear_settings_version
+from payments.utils.checkout import create_checkout_session, get_checkout_request
+from payments.utils.http import make_get_request, make_post_request
 
 
 class RazorpaySettings(Document):
@@ -83,6 +80,8 @@ class RazorpaySettings(Document):
 
 	def init_client(self):
 		if self.api_key:
+			import razorpay
+
 			secret = self.get_password(fieldname="api_secret", raise_exception=False)
 			self.client = razorpay.Client(auth=(self.api_key, secret))
 
@@ -92,6 +91,9 @@ class RazorpaySettings(Document):
 		if not self.flags.ignore_mandatory:
 			self.validate_razorpay_credentails()
 
+	def on_update(self):
+		clear_settings_version(self.doctype)
+
 	def validate_razorpay_credentails(self):
 		if self.api_key and self.api_secret:
 			try:
@@ -138,7 +140,7 @@ class RazorpaySettings(Document):
 				resp = make_post_request(
 					url,
 					auth=(settings.api_key, settings.api_secret),
-					data=json.dumps(addon),
+					data=codec.dumps(addon),
 					headers={"content-type": "application/json"},
 				)
 				if not resp.get("id"):
@@ -174,7 +176,7 @@ class RazorpaySettings(Document):
 			resp = make_post_request(
 				"https://api.razorpay.com/v1/subscriptions",
 				auth=(settings.api_key, settings.api_secret),
-				data=json.dumps(subscription_details),
+				data=codec.dumps(subscription_details),
 				headers={"content-type": "application/json"},
 			)
 
@@ -200,8 +202,15 @@ class RazorpaySettings(Document):
 		return kwargs
 
 	def get_payment_url(self, **kwargs):
-		integration_request = create_request_log(kwargs, service_name="Razorpay")
-		return get_url(f"./razorpay_checkout?token={integration_request.name}")
+		token = create_checkout_session(kwargs, service_name="Razorpay")
+		return get_url(f"./razorpay_checkout?token={token}")
+
+	def get_payment_urls(self, payment_details):
+		names = create_request_logs(payment_details, service_name="Razorpay")
+		return {
+			details["reference_docname"]: get_url(f"./razorpay_checkout?token={name}")
+			for name, details in zip(names, payment_details)
+		}
 
 	def create_order(self, **kwargs):
 		# Creating Orders https://razorpay.com/docs/api/orders/
@@ -239,7 +248,7 @@ class RazorpaySettings(Document):
 		self.data = frappe._dict(data)
 
 		try:
-			self.integration_request = frappe.get_doc("Integration Request", self.data.token)
+			self.integration_request = get_checkout_request(self.data.token)
 			self.integration_request.update_status(self.data, "Queued")
 			return self.authorize_payment()
 
@@ -261,7 +270,7 @@ class RazorpaySettings(Document):
 		The money is deducted from the customer’s account, but will not be transferred to the merchant’s account
 		until it is explicitly captured by merchant.
 		"""
-		data = json.loads(self.integration_request.data)
+		data = codec.loads(self.integration_request.data)
 		settings = self.get_settings(data)
 
 		try:
@@ -270,13 +279,14 @@ class RazorpaySettings(Document):
 				auth=(settings.api_key, settings.api_secret),
 			)
 
+			# The payment hooks only run in the worker that changed the status
 			if resp.get("status") == "authorized":
-				self.integration_request.update_status(data, "Authorized")
-				self.flags.status_changed_to = "Authorized"
+				if self.integration_request.update_status({}, "Authorized"):
+					self.flags.status_changed_to = "Authorized"
 
 			if resp.get("status") == "captured":
-				self.integration_request.update_status(data, "Completed")
-				self.flags.status_changed_to = "Completed"
+				if self.integration_request.update_status({}, "Completed"):
+					self.flags.status_changed_to = "Completed"
 
 			elif data.get("subscription_id"):
 				if resp.get("status") == "refunded":
@@ -284,8 +294,8 @@ class RazorpaySettings(Document):
 					# razorpay refunds the amount after authorizing the card details
 					# thus changing status to Verified
 
-					self.integration_request.update_status(data, "Completed")
-					self.flags.status_changed_to = "Verified"
+					if self.integration_request.update_status({}, "Completed"):
+						self.flags.status_changed_to = "Verified"
 
 			else:
 				frappe.log_error(message=str(resp), title="Razorpay Payment not authorized")
@@ -297,8 +307,14 @@ class RazorpaySettings(Document):
 
 		redirect_to = data.get("redirect_to") or None
 		redirect_message = data.get("redirect_message") or None
-		if self.flags.status_changed_to in ("Authorized", "Verified", "Completed"):
-			if self.data.reference_doctype and self.data.reference_docname:
+		if self.flags.status_changed_to in ("Authorized", "Verified", "Completed") or (
+			self.integration_request.status in ("Authorized", "Completed")
+		):
+			if (
+				self.flags.status_changed_to
+				and self.data.reference_doctype
+				and self.data.reference_docname
+			):
 				custom_redirect_to = None
 				try:
 					frappe.flags.data = data
@@ -388,7 +404,7 @@ def capture_payment(is_sandbox=False, sanbox_response=None):
 			if is_sandbox:
 				resp = sanbox_response
 			else:
-				data = json.loads(doc.data)
+				data = codec.loads(doc.data)
 				settings = controller.get_settings(data)
 
 				resp = make_get_request(
@@ -407,14 +423,15 @@ def capture_payment(is_sandbox=False, sanbox_response=None):
 					)
 
 			if resp.get("status") == "captured":
-				frappe.db.set_value("Integration Request", doc.name, "status", "Completed")
+				frappe.get_doc("Integration Request", doc.name).update_status({}, "Completed")
 
 		except Exception:
-			doc = frappe.get_doc("Integration Request", doc.name)
-			doc.status = "Failed"
-			doc.error = frappe.get_traceback()
-			doc.save()
-			frappe.log_error(doc.error, f"{doc.name} Failed")
+			error = frappe.get_traceback()
+			request = frappe.get_doc("Integration Request", doc.name)
+			# A request completed by another worker in the meantime keeps its status
+			if request.update_status({}, "Failed"):
+				request.db_set("error", error)
+			frappe.log_error(error, f"{doc.name} Failed")
 
 
 @frappe.whitelist(allow_guest=True)
@@ -447,14 +464,13 @@ def order_payment_success(integration_request, params):
 	        integration_request (string): Name for integration request doc
 	        params (string): Params to be updated for integration request.
 	"""
-	params = json.loads(params)
+	params = codec.loads(params)
 	integration = frappe.get_doc("Integration Request", integration_request)
 
-	# Update integration request
+	# Update integration request, the document is kept in sync
 	integration.update_status(params, integration.status)
-	integration.reload()
 
-	data = json.loads(integration.data)
+	data = codec.loads(integration.data)
 	controller = frappe.get_doc("Razorpay Settings")
 
 	# Update payment and integration data for payment controller object
@@ -474,7 +490,7 @@ def order_payment_failure(integration_request, params):
 	        params (TYPE): error data to be updated
 	"""
 	frappe.log_error(params, "Razorpay Payment Failure")
-	params = json.loads(params)
+	params = codec.loads(params)
 	integration = frappe.get_doc("Integration Request", integration_request)
 	integration.update_status(params, integration.status)
 
@@ -497,7 +513,7 @@ def razorpay_subscription_callback():
 
 		doc = frappe.get_doc(
 			{
-				"data": json.dumps(frappe.local.form_dict),
+				"data": codec.dumps(frappe.local.form_dict),
 				"doctype": "Integration Request",
 				"request_description": "Subscription Notification",
 				"is_remote_request": 1,
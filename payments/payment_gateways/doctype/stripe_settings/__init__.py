@@ -2,20 +2,20 @@
 # For license information, please see license.txt
 
 
-import json
 from urllib.parse import parse_qs
 
 import frappe
-import stripe
 from frappe import _
 
+from payments.utils import codec
+
 TEST_EVENT_ID = "evt_00000000000000"
 
 
 @frappe.whitelist(allow_guest=True)
 def webhooks():
 	r = frappe.request
-	payload = json.loads(r.get_data()) or []
+	payload = codec.loads(r.get_data()) or []
 	if not payload:
 		frappe.response.message = "Missing payload"
 		frappe.response.http_status_code = 400
@@ -25,6 +25,8 @@ def webhooks():
 
 	event = None
 	try:
+		import stripe
+
 		event = stripe.Event.construct_from(payload, webhook_secret, stripe_key)
 	except Exception:
 		frappe.response.message = "Webhook event construction failed"
@@ -80,7 +82,7 @@ def create_new_integration_log(event, account):
 			"service_document": event.type.split(".")[0],
 			"service_status": event.type.split(".")[1],
 			"service_id": event.data.object.get("id"),
-			"data": json.dumps(event, indent=4),
+			"data": codec.dumps(event),
 			"payment_gateway_controller": account,
 		}
 	)
@@ -1,5 +1,6 @@
 from .charge import StripeCharge
 from .customer import StripeCustomer
+from .event import StripeEvent
 from .invoice import StripeInvoice
 from .invoice_item import StripeInvoiceItem
 from .payment_intent import StripePaymentIntent
@@ -0,0 +1,14 @@
+from payments.payment_gateways.doctype.stripe_settings.api.errors import handle_stripe_errors
+
+
+class StripeEvent:
+	def __init__(self, gateway):
+		self.gateway = gateway
+
+	@handle_stripe_errors
+	def retrieve(self, id):
+		return self.gateway.stripe.Event.retrieve(id)
+
+	@handle_stripe_errors
+	def get_list(self, created_since, **kwargs):
+		return self.gateway.stripe.Event.list(created={"gte": created_since}, limit=100, **kwargs)
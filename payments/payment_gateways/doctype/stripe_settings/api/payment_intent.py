@@ -21,6 +21,12 @@ class StripePaymentIntent:
 	def retrieve(self, id, client_secret):
 		return self.gateway.stripe.PaymentIntent.retrieve(id, client_secret=client_secret)
 
+	@handle_stripe_errors
+	def get_list(self, created_before, created_since, **kwargs):
+		return self.gateway.stripe.PaymentIntent.list(
+			created={"lt": created_before, "gte": created_since}, limit=100, **kwargs
+		)
+
 	@handle_stripe_errors
 	def update(self, id, **kwargs):
 		return self.gateway.stripe.PaymentIntent.modify(id, **kwargs)
@@ -1,7 +1,6 @@
 from hashlib import sha224
 
 import frappe
-import stripe
 from frappe import _
 
 
@@ -17,6 +16,8 @@ class IdempotencyKey:
 
 def handle_idempotency(func):
 	def wrapper(*args, **kwargs):
+		import stripe
+
 		try:
 			return func(*args, **kwargs)
 		except stripe.error.IdempotencyError:
@@ -2,29 +2,65 @@
 # For license information, please see license.txt
 
 
+import time
+from itertools import islice
 from urllib.parse import urlencode
 
 import frappe
-import stripe
+import pytz
 from frappe import _
 from frappe.integrations.utils import PaymentGatewayController
-from frappe.utils import call_hook_method, cint, flt, get_url, getdate, nowdate
+from frappe.utils import (
+	add_days,
+	call_hook_method,
+	cint,
+	create_batch,
+	flt,
+	get_datetime,
+	get_time_zone,
+	get_url,
+	getdate,
+	nowdate,
+)
 from payments.utils import create_payment_gateway
-
-# TODO: Move to hook
-from erpnext.accounts.doctype.subscription.subscription_state_manager import SubscriptionPeriod
+from payments.utils.cache import clear_settings_version, get_process_cached_value
+from payments.utils.http import (
+	DEFAULT_TIMEOUT,
+	MAX_RETRIES,
+	get_session,
+	run_concurrently,
+	run_request_hooks,
+)
+from payments.payment_gateways.doctype.stripe_settings import create_new_integration_log
 from payments.payment_gateways.doctype.stripe_settings.api import (
 	StripeCustomer,
+	StripeEvent,
 	StripeInvoiceItem,
 	StripePaymentIntent,
 	StripePrice,
 	StripeWebhookEndpoint,
 )
-from payments.payment_gateways.doctype.stripe_settings.webhook_events import (
-	StripeChargeWebhookHandler,
-	StripeInvoiceWebhookHandler,
-	StripePaymentIntentWebhookHandler,
-)
+
+STRIPE_API_URL = "https://api.stripe.com"
+
+_http_client = None
+
+# PaymentIntents in these statuses are still waiting for their payer
+ABANDONED_PAYMENT_INTENT_STATUSES = ("requires_payment_method", "requires_confirmation", "requires_action")
+# Set in the metadata of the PaymentIntents created by the checkout page. Off-session payments,
+# which may also wait for an authentication of their payer, are never cancelled.
+CHECKOUT_METADATA_KEY = "payments_checkout"
+# Only the PaymentIntents created in the days before the abandon delay are looked up
+ABANDONED_PAYMENT_INTENT_LOOKBACK = 2
+CANCELLATION_WORKERS = 10
+CANCELLATION_RATE_LIMIT = 20
+
+# Event type prefixes handled by `get_webhook_handlers`
+WEBHOOK_EVENT_TYPES = ("charge", "payment_intent", "invoice")
+# Stored events in these statuses were not handled yet, or failed: they are handled again on replay
+REPLAYED_EVENT_STATUSES = ("Queued", "Failed")
+# Events listed per page by the Stripe Events API
+EVENT_PAGE_SIZE = 100
 
 
 class StripeSettings(PaymentGatewayController):
@@ -62,10 +98,23 @@ class StripeSettings(PaymentGatewayController):
 	def before_insert(self):
 		self.gateway_name = frappe.scrub(self.gateway_name)
 
-	def configure_stripe(self):
+	def on_load_from_cache(self):
+		# The Stripe client is global: point it back to this account
+		self.configure_stripe()
+
+	def configure_stripe(self, api_key=None):
+		import stripe
+
 		self.stripe = stripe
-		self.stripe.api_key = self.get_password(fieldname="secret_key", raise_exception=False)
-		self.stripe.default_http_client = stripe.http_client.RequestsClient()
+		self.stripe.api_key = api_key or get_process_cached_value(
+			self.doctype,
+			self.name,
+			"secret_key",
+			lambda: self.get_password(fieldname="secret_key", raise_exception=False),
+		)
+		self.stripe.default_http_client = get_http_client()
+		# The SDK adds an idempotency key to the requests it retries
+		self.stripe.max_network_retries = MAX_RETRIES
 
 	def get_supported_currencies(self):
 		account = self.stripe.Account.retrieve()
@@ -80,12 +129,13 @@ class StripeSettings(PaymentGatewayController):
 			"Stripe-" + self.gateway_name, settings="Stripe Settings", controller=self.gateway_name
 		)
 		call_hook_method("payment_gateway_enabled", gateway="Stripe-" + self.gateway_name)
+		clear_settings_version(self.doctype, self.name)
 		if not self.flags.ignore_mandatory:
 			self.validate_stripe_credentials()
 
 	def validate_stripe_credentials(self):
 		try:
-			self.configure_stripe()
+			self.configure_stripe(self.get_password(fieldname="secret_key", raise_exception=False))
 			balance = self.stripe.Balance.retrieve()
 			return balance
 		except Exception as e:
@@ -145,7 +195,7 @@ class StripeSettings(PaymentGatewayController):
 					)
 				)
 			return stripe_plan
-		except stripe.error.InvalidRequestError:
+		except self.stripe.error.InvalidRequestError:
 			frappe.throw(_("Invalid Stripe plan or currency: {0} - {1}").format(plan, currency))
 
 	def get_stripe_invoice_item(self, item, currency):
@@ -158,10 +208,13 @@ class StripeSettings(PaymentGatewayController):
 					)
 				)
 			return invoice_item
-		except stripe.error.InvalidRequestError:
+		except self.stripe.error.InvalidRequestError:
 			frappe.throw(_("Invalid currency for invoice item: {0} - {1}").format(item, currency))
 
 	def validate_next_invoice_date(self, subscription):
+		# TODO: Move to hook
+		from erpnext.accounts.doctype.subscription.subscription_state_manager import SubscriptionPeriod
+
 		next_invoice_date = SubscriptionPeriod(subscription).get_next_invoice_date()
 		if getdate(next_invoice_date) < getdate(nowdate()):
 			frappe.throw(
@@ -256,17 +309,179 @@ class StripeSettings(PaymentGatewayController):
 			)
 
 
+def cancel_abandoned_payment_intents(created_before):
+	"""Cancel the PaymentIntents of abandoned checkouts, for every Stripe account"""
+	created_since = add_days(created_before, -ABANDONED_PAYMENT_INTENT_LOOKBACK)
+
+	for account in frappe.get_all("Stripe Settings", pluck="name"):
+		stripe_settings = frappe.get_doc("Stripe Settings", account)
+		# The global API key of the SDK can be changed by another account loaded in the meantime
+		api_key = stripe_settings.get_password(fieldname="secret_key", raise_exception=False)
+
+		payment_intents = StripePaymentIntent(stripe_settings, None).get_list(
+			cint(created_before.timestamp()), cint(created_since.timestamp()), api_key=api_key
+		)
+		if not payment_intents:
+			continue
+
+		payment_intent_ids = [
+			payment_intent.id
+			for payment_intent in payment_intents.auto_paging_iter()
+			if payment_intent.status in ABANDONED_PAYMENT_INTENT_STATUSES
+			and payment_intent.metadata.get(CHECKOUT_METADATA_KEY)
+		]
+
+		# The SDK only makes HTTP calls here: it can be used from the threads
+		failed_cancellations = [
+			f"{payment_intent_id}: {error}"
+			for payment_intent_id, result, error in run_concurrently(
+				lambda payment_intent_id: stripe_settings.stripe.PaymentIntent.cancel(
+					payment_intent_id, cancellation_reason="abandoned", api_key=api_key
+				),
+				payment_intent_ids,
+				max_workers=CANCELLATION_WORKERS,
+				rate_limit=CANCELLATION_RATE_LIMIT,
+			)
+			if error
+		]
+
+		if failed_cancellations:
+			frappe.log_error(
+				"\n".join(failed_cancellations),
+				_("Stripe PaymentIntent cancellation failed for {0}").format(account),
+			)
+
+
+def get_http_client():
+	"""Return a Stripe HTTP client sending its requests through the pooled gateway transport"""
+	global _http_client
+	if not _http_client:
+		import stripe
+
+		class PooledRequestsClient(stripe.http_client.RequestsClient):
+			def request(self, method, url, *args, **kwargs):
+				start = time.monotonic()
+				status_code = exception = None
+				try:
+					response = super().request(method, url, *args, **kwargs)
+					status_code = response[1]
+					return response
+				except Exception as e:
+					exception = e
+					raise
+				finally:
+					run_request_hooks(
+						method=method.upper(),
+						url=url,
+						status_code=status_code,
+						duration=time.monotonic() - start,
+						attempt=0,
+						exception=exception,
+					)
+
+		_http_client = PooledRequestsClient(
+			timeout=DEFAULT_TIMEOUT, session=get_session(STRIPE_API_URL)
+		)
+
+	return _http_client
+
+
 def handle_webhooks(**kwargs):
 	# TODO: Refactor implementation
 	from erpnext.erpnext_integrations.webhooks_controller import handle_webhooks as _handle_webhooks
 
-	WEBHOOK_HANDLERS = {
+	_handle_webhooks(get_webhook_handlers(), **kwargs)
+
+
+def get_webhook_handlers():
+	# The handlers depend on ERPNext: they are only imported when a webhook is processed
+	from payments.payment_gateways.doctype.stripe_settings.webhook_events import (
+		StripeChargeWebhookHandler,
+		StripeInvoiceWebhookHandler,
+		StripePaymentIntentWebhookHandler,
+	)
+
+	return {
 		"charge": StripeChargeWebhookHandler,
 		"payment_intent": StripePaymentIntentWebhookHandler,
 		"invoice": StripeInvoiceWebhookHandler,
 	}
 
-	_handle_webhooks(WEBHOOK_HANDLERS, **kwargs)
+
+@frappe.whitelist()
+def backfill_webhook_events(since, accounts=None):
+	"""Replay the Stripe events created since `since` for each Stripe account.
+
+	One background job is enqueued per account so that accounts are fetched in parallel.
+	"""
+	frappe.only_for("System Manager")
+
+	if isinstance(accounts, str):
+		accounts = frappe.parse_json(accounts)
+
+	for account in accounts or frappe.get_all("Stripe Settings", pluck="name"):
+		frappe.enqueue(
+			method="payments.payment_gateways.doctype.stripe_settings.stripe_settings.replay_webhook_events",
+			queue="long",
+			timeout=3600,
+			is_async=True,
+			account=account,
+			since=since,
+		)
+
+
+def replay_webhook_events(account, since):
+	"""Fetch the events created since `since` from the Stripe Events API and handle the ones
+	that have not been stored as Integration Requests yet, or whose handling failed.
+
+	Events are processed one page at a time, from the newest page to the oldest one.
+	"""
+	stripe_settings = frappe.get_doc("Stripe Settings", account)
+	# `since` is a datetime in the system timezone
+	since = pytz.timezone(get_time_zone()).localize(get_datetime(since))
+	events = StripeEvent(stripe_settings).get_list(cint(since.timestamp()))
+	if not events:
+		return 0
+
+	replayed = 0
+	events = events.auto_paging_iter()
+	while True:
+		page = list(islice(events, EVENT_PAGE_SIZE))
+		if not page:
+			break
+
+		page = [event for event in page if event.type.split(".")[0] in WEBHOOK_EVENT_TYPES]
+		if not page:
+			continue
+
+		stored_events = dict(
+			frappe.get_all(
+				"Integration Request",
+				filters={"name": ("in", [event.id for event in page])},
+				fields=["name", "status"],
+				as_list=True,
+			)
+		)
+
+		# Stripe lists events from the newest to the oldest
+		for event in reversed(page):
+			if event.id in stored_events and stored_events[event.id] not in REPLAYED_EVENT_STATUSES:
+				continue
+
+			try:
+				if event.id in stored_events:
+					docname = event.id
+				else:
+					docname = create_new_integration_log(event, account).name
+
+				handle_webhooks(doctype="Integration Request", docname=docname)
+				frappe.db.commit()
+				replayed += 1
+			except Exception:
+				frappe.db.rollback()
+				frappe.log_error(_("Stripe event {0} could not be replayed").format(event.id))
+
+	return replayed
 
 
 @frappe.whitelist()
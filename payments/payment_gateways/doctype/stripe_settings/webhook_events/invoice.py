@@ -2,7 +2,6 @@
 # For license information, please see license.txt
 
 import datetime
-import json
 
 import frappe
 from frappe import _
@@ -1,8 +1,6 @@
 # Copyright (c) 2020, Dokos SAS and contributors
 # For license information, please see license.txt
 
-import json
-
 import frappe
 from frappe import _
 from frappe.utils import flt
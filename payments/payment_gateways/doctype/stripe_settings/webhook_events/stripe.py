@@ -2,13 +2,13 @@
 # For license information, please see license.txt
 
 import datetime
-import json
 
 import frappe
 from frappe import _
 from frappe.utils import add_days, flt, getdate
 
 from payments.payment_gateways.doctype.stripe_settings.api import StripeCharge, StripeInvoice
+from payments.utils import codec
 # TODO: Refactor implementation
 from erpnext.erpnext_integrations.webhooks_controller import WebhooksController
 
@@ -149,7 +149,7 @@ class StripeWebhooksController(WebhooksController):
 				if payment_entry.total_allocated_amount and payment_entry.unallocated_amount:
 					payment_entry.deductions[0].amount -= flt(payment_entry.unallocated_amount)
 
-		self.integration_request.db_set("output", json.dumps(output, indent=4))
+		self.integration_request.db_set("output", codec.dumps(output))
 
 	def create_submit_payment(self):
 		self.get_charges()
@@ -0,0 +1,10 @@
+// Copyright (c) 2026, Dokos SAS and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Integration Request Archive', {
+	refresh: function(frm) {
+		frm.add_custom_button(__('Open Integration Request'), () => {
+			frappe.set_route('Form', 'Integration Request', frm.doc.name);
+		});
+	}
+});
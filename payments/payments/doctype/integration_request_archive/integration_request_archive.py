@@ -0,0 +1,101 @@
+# Copyright (c) 2026, Dokos SAS and contributors
+# License: MIT. See LICENSE
+
+import base64
+import zlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, cint, now, now_datetime
+
+from payments.utils import codec
+
+# Requests in a final status and untouched for this many days are archived,
+# unless `integration_request_archive_days` is set in the site config
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVED_STATUSES = ("Completed", "Failed", "Cancelled", "Expired")
+# Completed requests of recurring profiles stay in the table: the profile sync looks them up there
+RECURRING_PROFILE_PATTERN = '%"profile_id"%'
+ARCHIVE_BATCH_SIZE = 500
+
+
+class IntegrationRequestArchive(Document):
+	def get_integration_request(self):
+		return decompress(self.compressed_data)
+
+
+def compress(data):
+	return base64.b64encode(
+		zlib.compress(frappe.safe_encode(codec.dumps(data)), 9)
+	).decode()
+
+
+def decompress(data):
+	return codec.loads(zlib.decompress(base64.b64decode(data)))
+
+
+def get_archived_integration_request(name):
+	"""Return the fields of an archived Integration Request, or None if it was not archived"""
+	compressed_data = frappe.db.get_value("Integration Request Archive", name, "compressed_data")
+	if compressed_data:
+		return decompress(compressed_data)
+
+
+def archive_integration_requests():
+	"""Move the old Integration Requests in a final status to the compressed archive"""
+	archive_after = cint(frappe.conf.integration_request_archive_days) or ARCHIVE_AFTER_DAYS
+	modified_before = add_days(now_datetime(), -archive_after)
+
+	fields = [
+		"name",
+		"creation",
+		"modified",
+		"owner",
+		"modified_by",
+		"integration_request_service",
+		"status",
+		"request_creation",
+		"reference_doctype",
+		"reference_docname",
+		"compressed_data",
+	]
+
+	while True:
+		requests = frappe.get_all(
+			"Integration Request",
+			filters={
+				"status": ("in", ARCHIVED_STATUSES),
+				"modified": ("<", modified_before),
+				"data": ("not like", RECURRING_PROFILE_PATTERN),
+			},
+			fields=["*"],
+			order_by="modified asc",
+			limit=ARCHIVE_BATCH_SIZE,
+		)
+		if not requests:
+			break
+
+		timestamp = now()
+		frappe.db.bulk_insert(
+			"Integration Request Archive",
+			fields,
+			[
+				(
+					request.name,
+					timestamp,
+					timestamp,
+					request.owner,
+					request.modified_by,
+					request.integration_request_service,
+					request.status,
+					request.creation,
+					request.get("reference_doctype"),
+					request.get("reference_docname"),
+					compress(request),
+				)
+				for request in requests
+			],
+			ignore_duplicates=True,
+		)
+		frappe.db.delete("Integration Request", {"name": ("in", [request.name for request in requests])})
+		frappe.db.commit()
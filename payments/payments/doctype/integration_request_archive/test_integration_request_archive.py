@@ -0,0 +1,85 @@
+# Copyright (c) 2026, Dokos SAS and Contributors
+# License: MIT. See LICENSE
+import unittest
+
+import frappe
+from frappe.utils import add_days, now_datetime
+
+from payments.payments.doctype.integration_request_archive.integration_request_archive import (
+	ARCHIVE_AFTER_DAYS,
+	archive_integration_requests,
+	compress,
+	decompress,
+)
+from payments.utils import codec
+
+
+class TestIntegrationRequestArchive(unittest.TestCase):
+	def setUp(self):
+		self.names = []
+
+	def tearDown(self):
+		for name in self.names:
+			frappe.db.delete("Integration Request", {"name": name})
+			frappe.db.delete("Integration Request Archive", {"name": name})
+		frappe.db.commit()
+
+	def make_old_request(self, data):
+		doc = frappe.get_doc(
+			{
+				"doctype": "Integration Request",
+				"integration_request_service": "PayPal",
+				"status": "Completed",
+				"data": codec.dumps(data),
+			}
+		).insert(ignore_permissions=True)
+		self.names.append(doc.name)
+
+		frappe.db.set_value(
+			"Integration Request",
+			doc.name,
+			"modified",
+			add_days(now_datetime(), -ARCHIVE_AFTER_DAYS - 1),
+			update_modified=False,
+		)
+		frappe.db.commit()
+		return doc.name
+
+	def test_compress_round_trip(self):
+		data = {"name": "IR-0001", "data": codec.dumps({"amount": 10.5, "currency": "EUR"})}
+		self.assertEqual(decompress(compress(data)), data)
+
+	def test_read_through_and_restore(self):
+		name = self.make_old_request({"amount": 10.5, "currency": "EUR"})
+		archive_integration_requests()
+
+		self.assertFalse(frappe.db.exists("Integration Request", name))
+		self.assertTrue(frappe.db.exists("Integration Request Archive", name))
+
+		doc = frappe.get_doc("Integration Request", name)
+		self.assertTrue(doc.flags.archived)
+		self.assertEqual(codec.loads(doc.data), {"amount": 10.5, "currency": "EUR"})
+
+		doc.db_set("output", "restored")
+
+		self.assertFalse(frappe.db.exists("Integration Request Archive", name))
+		self.assertEqual(frappe.db.get_value("Integration Request", name, "output"), "restored")
+
+	def test_save_archived_request(self):
+		name = self.make_old_request({"amount": 10.5, "currency": "EUR"})
+		archive_integration_requests()
+
+		doc = frappe.get_doc("Integration Request", name)
+		doc.output = "saved"
+		doc.save(ignore_permissions=True)
+
+		self.assertFalse(doc.flags.archived)
+		self.assertFalse(frappe.db.exists("Integration Request Archive", name))
+		self.assertEqual(frappe.db.get_value("Integration Request", name, "output"), "saved")
+
+	def test_recurring_profiles_are_not_archived(self):
+		name = self.make_old_request({"profile_id": "I-TEST"})
+		archive_integration_requests()
+
+		self.assertTrue(frappe.db.exists("Integration Request", name))
+		self.assertFalse(frappe.db.exists("Integration Request Archive", name))
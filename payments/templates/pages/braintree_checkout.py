@@ -1,13 +1,13 @@
 # Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
 # License: MIT. See LICENSE
 
-import json
-
 import frappe
 from frappe import _
 from payments.payment_gateways.doctype.braintree_settings.braintree_settings  import get_gateway_controller
 from frappe.utils import fmt_money
 
+from payments.utils import codec
+
 EXPECTED_KEYS = (
 	"amount",
 	"title",
@@ -45,7 +45,7 @@ def get_context(context):
 
 @frappe.whitelist(allow_guest=True)
 def make_payment(payload_nonce, data):
-	data = frappe.parse_json(data)
+	data = frappe._dict(codec.loads(data) if isinstance(data, str) else data)
 	data.update({"payload_nonce": payload_nonce})
 
 	gateway_controller = get_gateway_controller(data["reference_doctype"], data["reference_docname"])
@@ -7,6 +7,6 @@ import frappe
 def get_context(context):
 	token = frappe.local.form_dict.token
 
-	if token:
-		frappe.db.set_value("Integration Request", token, "status", "Cancelled")
-		frappe.db.commit()
+	if token and frappe.db.exists("Integration Request", token):
+		# Requests completed in the meantime keep their status
+		frappe.get_doc("Integration Request", token).update_status({}, "Cancelled")
@@ -1,14 +1,13 @@
 # Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
 # License: MIT. See LICENSE
-import json
-
 import frappe
 from frappe import _
 
 from payments.payment_gateways.doctype.paytm_settings.paytm_settings import (
+	get_paytm_checkout_params,
 	get_paytm_config,
-	get_paytm_params,
 )
+from payments.utils.checkout import redirect_to_expired_checkout
 
 
 def get_context(context):
@@ -16,14 +15,15 @@ def get_context(context):
 	paytm_config = get_paytm_config()
 
 	try:
-		doc = frappe.get_doc("Integration Request", frappe.form_dict["order_id"])
-
-		context.payment_details = get_paytm_params(
-			json.loads(doc.data), doc.name, paytm_config
+		context.payment_details = get_paytm_checkout_params(
+			frappe.form_dict["order_id"], paytm_config
 		)
 
 		context.url = paytm_config.url
 
+	except frappe.DoesNotExistError:
+		redirect_to_expired_checkout()
+
 	except Exception:
 		frappe.log_error()
 		frappe.redirect_to_message(
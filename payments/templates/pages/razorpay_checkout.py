@@ -1,11 +1,13 @@
 # Copyright (c) 2021, Frappe Technologies Pvt. Ltd. and Contributors
 # License: MIT. See LICENSE
-import json
 
 import frappe
 from frappe import _
 from frappe.utils import cint, flt
 
+from payments.utils import codec
+from payments.utils.checkout import get_checkout_request, redirect_to_expired_checkout
+
 no_cache = 1
 
 expected_keys = (
@@ -26,8 +28,10 @@ def get_context(context):
 	context.api_key = get_api_key()
 
 	try:
-		doc = frappe.get_doc("Integration Request", frappe.form_dict["token"])
-		payment_details = json.loads(doc.data)
+		# Written when the page renders, so that the payment made at Razorpay can be recorded
+		# even if the checkout session expires in the meantime
+		integration_request = get_checkout_request(frappe.form_dict["token"])
+		payment_details = codec.loads(integration_request.data)
 
 		for key in expected_keys:
 			context[key] = payment_details[key]
@@ -38,6 +42,9 @@ def get_context(context):
 			payment_details["subscription_id"] if payment_details.get("subscription_id") else ""
 		)
 
+	except frappe.DoesNotExistError:
+		redirect_to_expired_checkout()
+
 	except Exception:
 		frappe.redirect_to_message(
 			_("Invalid Token"),
@@ -65,7 +72,7 @@ def make_payment(
 	data = {}
 
 	if isinstance(options, str):
-		data = json.loads(options)
+		data = codec.loads(options)
 
 	data.update(
 		{
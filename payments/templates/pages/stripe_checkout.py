@@ -8,8 +8,6 @@ from frappe import _
 from frappe.integrations.utils import get_gateway_controller
 from frappe.utils import cint, flt, fmt_money, get_datetime, getdate, nowdate
 
-# TODO: Move to hook
-from erpnext.accounts.doctype.subscription.subscription_state_manager import SubscriptionPeriod
 from payments.payment_gateways.doctype.stripe_settings.api import (
 	StripeCustomer,
 	StripeInvoice,
@@ -17,6 +15,9 @@ from payments.payment_gateways.doctype.stripe_settings.api import (
 	StripePaymentMethod,
 	StripeSubscription,
 )
+from payments.payment_gateways.doctype.stripe_settings.stripe_settings import (
+	CHECKOUT_METADATA_KEY,
+)
 
 expected_keys = (
 	"amount",
@@ -140,6 +141,8 @@ def make_payment_intent(
 			"reference_doctype": payment_request.reference_doctype,
 			"reference_name": payment_request.reference_name,
 			"payment_request": payment_request.name,
+			# Only the PaymentIntents of abandoned checkouts are cancelled
+			CHECKOUT_METADATA_KEY: 1,
 		}
 	)
 
@@ -190,6 +193,9 @@ def retry_invoice(**kwargs):
 
 @frappe.whitelist(allow_guest=True)
 def make_subscription(**kwargs):
+	# TODO: Move to hook
+	from erpnext.accounts.doctype.subscription.subscription_state_manager import SubscriptionPeriod
+
 	payment_request, payment_gateway = _update_payment_method(**kwargs)
 
 	subscription = frappe.get_doc("Subscription", payment_request.is_linked_to_a_subscription())
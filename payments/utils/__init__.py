@@ -1,7 +1,10 @@
 from payments.utils.utils import ( # noqa
 	before_install,
 	create_payment_gateway,
+	create_request_logs,
 	delete_custom_fields,
 	get_payment_gateway_controller,
+	get_payment_urls,
 	after_install,
+	after_migrate,
 )
@@ -0,0 +1,70 @@
+import copy
+
+import frappe
+
+SETTINGS_VERSION_KEY = "payments_settings_version"
+
+# Gateway clients stay shared between the copies of a cached controller
+SHARED_CONTROLLER_ATTRIBUTES = ("gateway", "stripe", "client")
+
+_process_cache = {}
+
+
+def get_settings_version(doctype, name=None):
+	"""Return the last modification timestamp of a settings document.
+
+	The timestamp is kept in redis so that reading it does not hit the database.
+	"""
+	name = name or doctype
+	return frappe.cache().hget(
+		SETTINGS_VERSION_KEY,
+		f"{doctype}:{name}",
+		generator=lambda: str(frappe.db.get_value(doctype, name, "modified")),
+	)
+
+
+def clear_settings_version(doctype, name=None):
+	"""Invalidate every value derived from a settings document once the transaction is committed"""
+	key = f"{doctype}:{name or doctype}"
+	frappe.db.after_commit.add(lambda: frappe.cache().hdel(SETTINGS_VERSION_KEY, key))
+
+
+def get_process_cached_value(doctype, name, key, generator):
+	"""Return a value derived from a settings document, kept in memory for the life of the process.
+
+	The value is built again by `generator` whenever the settings document is modified.
+	"""
+	version = get_settings_version(doctype, name)
+	cache_key = (frappe.local.site, doctype, name or doctype, key)
+
+	cached = _process_cache.get(cache_key)
+	if cached and cached[0] == version:
+		return cached[1]
+
+	value = generator()
+	_process_cache[cache_key] = (version, value)
+	return value
+
+
+def get_cached_controller(doctype, name=None):
+	"""Return a gateway settings document, loaded once per process and settings version.
+
+	Each caller gets its own deep copy, with its own flags and child tables, so that the state
+	set while processing a payment does not leak into the next one or into other threads.
+	Only the gateway clients are shared.
+	"""
+	cached = get_process_cached_value(
+		doctype, name, "controller", lambda: frappe.get_doc(doctype, name or doctype)
+	)
+
+	memo = {
+		id(getattr(cached, attribute)): getattr(cached, attribute)
+		for attribute in SHARED_CONTROLLER_ATTRIBUTES
+		if hasattr(cached, attribute)
+	}
+	controller = copy.deepcopy(cached, memo)
+
+	if hasattr(controller, "on_load_from_cache"):
+		controller.on_load_from_cache()
+
+	return controller
@@ -0,0 +1,145 @@
+import frappe
+from frappe import _
+from frappe.integrations.utils import create_request_log
+from frappe.utils import add_to_date, cint, now_datetime
+
+CHECKOUT_SESSION_KEY = "payments_checkout_session"
+
+# Checkout sessions expire after 24 hours unless `checkout_session_expiry`
+# (in seconds) is set in the site config
+CHECKOUT_SESSION_EXPIRY = 24 * 60 * 60
+
+# Queued checkouts older than this are considered abandoned
+ABANDONED_CHECKOUT_DELAY = 24
+ABANDONED_CHECKOUT_SERVICES = ("Razorpay", "Paytm", "PayPal")
+EXPIRY_BATCH_SIZE = 500
+
+
+def create_checkout_session(data, service_name):
+	"""Keep the payment details of a checkout page in the site cache.
+
+	No Integration Request is written until the payer opens the checkout page,
+	see `get_checkout_request`. Returns the session token, which becomes the name of
+	the Integration Request.
+
+	Links sent by email are written to the database right away instead: they must keep
+	working after the session expires or is evicted from the cache.
+	"""
+	token = frappe.generate_hash(length=10)
+
+	if is_emailed_payment_link(data):
+		create_request_log(data, service_name=service_name, name=token)
+		return token
+
+	frappe.cache().set_value(
+		f"{CHECKOUT_SESSION_KEY}:{token}",
+		{"service_name": service_name, "data": data},
+		expires_in_sec=cint(frappe.conf.checkout_session_expiry) or CHECKOUT_SESSION_EXPIRY,
+	)
+
+	return token
+
+
+def is_emailed_payment_link(data):
+	"""Payment Requests email their payment link, unless they are paid right away from the cart"""
+	if data.get("reference_doctype") != "Payment Request" or not data.get("reference_docname"):
+		return False
+
+	return not frappe.db.get_value("Payment Request", data["reference_docname"], "mute_email")
+
+
+def get_checkout_session(token):
+	return frappe.cache().get_value(f"{CHECKOUT_SESSION_KEY}:{token}")
+
+
+def get_checkout_request(token):
+	"""Return the Integration Request of a checkout, writing it from its session when the checkout
+	page is first opened.
+
+	Raises `frappe.DoesNotExistError` if the session expired or was evicted from the cache before.
+	"""
+	if frappe.db.exists("Integration Request", token):
+		return frappe.get_doc("Integration Request", token)
+
+	session = get_checkout_session(token)
+	if not session:
+		raise frappe.DoesNotExistError
+
+	try:
+		return create_request_log(session["data"], service_name=session["service_name"], name=token)
+	except frappe.DuplicateEntryError:
+		# Written by a concurrent attempt
+		return frappe.get_doc("Integration Request", token)
+
+
+def redirect_to_expired_checkout():
+	frappe.redirect_to_message(
+		_("Payment Link Expired"),
+		_("This payment link has expired. Please ask for a new one."),
+		http_status_code=404,
+		indicator_color="red",
+	)
+
+	frappe.local.flags.redirect_location = frappe.local.response.location
+	raise frappe.Redirect
+
+
+def expire_abandoned_checkouts():
+	"""Move the checkouts abandoned by their payer to the Expired status.
+
+	Razorpay orders, Paytm orders and PayPal tokens expire on their own at the gateway:
+	only the Stripe PaymentIntents need to be cancelled remotely.
+	"""
+	from payments.payment_gateways.doctype.stripe_settings.stripe_settings import (
+		cancel_abandoned_payment_intents,
+	)
+
+	created_before = add_to_date(now_datetime(), hours=-ABANDONED_CHECKOUT_DELAY)
+
+	while True:
+		# Scans the (status, creation) range of the queued requests, oldest first.
+		# Remote requests, like the queued subscription notifications, are not checkouts.
+		names = frappe.get_all(
+			"Integration Request",
+			filters={
+				"status": "Queued",
+				"creation": ("<", created_before),
+				"integration_request_service": ("in", ABANDONED_CHECKOUT_SERVICES),
+				"is_remote_request": 0,
+			},
+			order_by="creation asc",
+			limit=EXPIRY_BATCH_SIZE,
+			pluck="name",
+		)
+		if not names:
+			break
+
+		# Bulk compare-and-set: requests paid in the meantime keep their status, and bumping
+		# the version makes a concurrent `update_status` check its transition again
+		frappe.db.sql(
+			"""update `tabIntegration Request`
+			set `status` = 'Expired', `status_version` = `status_version` + 1
+			where `name` in %(names)s and `status` = 'Queued'""",
+			{"names": names},
+		)
+		frappe.db.commit()
+
+	cancel_abandoned_payment_intents(created_before)
+
+
+def add_expired_status():
+	"""Add the Expired status to the options of the Integration Request status"""
+	from frappe.custom.doctype.property_setter.property_setter import make_property_setter
+
+	options = frappe.get_meta("Integration Request").get_field("status").options.split("\n")
+	if "Expired" in options:
+		return
+
+	make_property_setter(
+		"Integration Request",
+		"status",
+		"options",
+		"\n".join(options + ["Expired"]),
+		"Text",
+		validate_fields_for_doctype=False,
+	)
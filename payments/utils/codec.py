@@ -0,0 +1,38 @@
+import json
+
+from frappe.utils.response import json_handler
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+# orjson leaves dates to `json_handler`, so that both backends format them like frappe
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else None
+
+
+def get_backend():
+	return "orjson" if orjson else "json"
+
+
+def loads(data):
+	"""Decode a JSON payload with orjson when it is installed, or with the standard library"""
+	if orjson:
+		return orjson.loads(data)
+
+	return json.loads(data)
+
+
+def dumps(obj, indent=None):
+	"""Encode an object to a JSON string, serializing frappe types like `frappe.as_json`.
+
+	orjson only produces compact output: indented documents use the standard library.
+	"""
+	if orjson and not indent:
+		try:
+			return orjson.dumps(obj, default=json_handler, option=ORJSON_OPTIONS).decode()
+		except TypeError:
+			# Integers above 64 bits and other types orjson refuses
+			pass
+
+	return json.dumps(obj, indent=indent, default=json_handler)
@@ -0,0 +1,217 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts used when a gateway does not specify its own, in seconds
+DEFAULT_TIMEOUT = (3.05, 30)
+
+# Connections kept open per host, shared by the threads of a process
+POOL_SIZE = 20
+
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.25
+RETRY_MAX_BACKOFF = 4
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+IDEMPOTENCY_HEADERS = ("Idempotency-Key", "PayPal-Request-Id")
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_request_hooks = []
+
+
+def get_session(url):
+	"""Return a keep-alive session shared by every request made to the host of `url`"""
+	host = urlparse(url).netloc
+	if host not in _sessions:
+		with _sessions_lock:
+			if host not in _sessions:
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+				session.mount("https://", adapter)
+				session.mount("http://", adapter)
+				_sessions[host] = session
+
+	return _sessions[host]
+
+
+def add_request_hook(hook):
+	"""Register a callable notified after each gateway request attempt.
+
+	It is called with `method`, `url`, `status_code` (None if no response was received),
+	`duration` in seconds, `attempt` and `exception`, possibly from a worker thread:
+	it must not use `frappe.db` or `frappe.local`.
+	"""
+	if hook not in _request_hooks:
+		_request_hooks.append(hook)
+
+
+def remove_request_hook(hook):
+	if hook in _request_hooks:
+		_request_hooks.remove(hook)
+
+
+def run_request_hooks(**kwargs):
+	for hook in _request_hooks:
+		try:
+			hook(**kwargs)
+		except Exception:
+			# Metrics must never break a payment
+			pass
+
+
+def is_idempotent(method, headers=None):
+	return method.upper() in IDEMPOTENT_METHODS or any(
+		header in (headers or {}) for header in IDEMPOTENCY_HEADERS
+	)
+
+
+def get_retry_delay(attempt, response=None):
+	"""Exponential backoff with full jitter, or the delay requested by the server"""
+	retry_after = response.headers.get("Retry-After") if response is not None else None
+	if retry_after and retry_after.isdigit():
+		return min(int(retry_after), RETRY_MAX_BACKOFF)
+
+	return random.uniform(0, min(RETRY_MAX_BACKOFF, RETRY_BACKOFF * 2**attempt))
+
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, retries=MAX_RETRIES, idempotent=None, **kwargs):
+	"""Send a request through the pooled session of the host of `url`.
+
+	Requests that never reached the server (connection timeouts) are always retried.
+	Read timeouts, dropped connections and transient error statuses are only retried
+	when replaying the request is safe: idempotent HTTP methods, requests carrying an
+	idempotency header, or when `idempotent` is set explicitly.
+
+	Returns the `requests.Response` of the last attempt, without raising for its status.
+	"""
+	if idempotent is None:
+		idempotent = is_idempotent(method, kwargs.get("headers"))
+
+	session = get_session(url)
+	attempt = 0
+	while True:
+		response = exception = None
+		start = time.monotonic()
+		try:
+			response = session.request(method, url, timeout=timeout, **kwargs)
+		except requests.exceptions.ConnectTimeout as e:
+			exception = e
+			retryable = True
+		except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+			exception = e
+			retryable = idempotent
+		else:
+			retryable = idempotent and response.status_code in RETRY_STATUS_CODES
+		finally:
+			run_request_hooks(
+				method=method,
+				url=url,
+				status_code=response.status_code if response is not None else None,
+				duration=time.monotonic() - start,
+				attempt=attempt,
+				exception=exception,
+			)
+
+		if not retryable or attempt >= retries:
+			if exception:
+				raise exception
+			return response
+
+		time.sleep(get_retry_delay(attempt, response))
+		attempt += 1
+
+
+def make_request(method, url, auth=None, headers=None, data=None, json=None, params=None, **kwargs):
+	"""Drop-in replacement of `frappe.integrations.utils.make_request` using the pooled transport"""
+	response = request(
+		method, url, auth=auth, headers=headers, data=data, json=json, params=params, **kwargs
+	)
+	response.raise_for_status()
+
+	if response.headers.get("content-type") == "text/plain; charset=utf-8":
+		return parse_qs(response.text)
+
+	return response.json()
+
+
+def make_get_request(url, **kwargs):
+	return make_request("GET", url, **kwargs)
+
+
+def make_post_request(url, **kwargs):
+	return make_request("POST", url, **kwargs)
+
+
+class RateLimiter:
+	"""Space out calls so that at most `rate` calls per second are made, across threads"""
+
+	def __init__(self, rate):
+		self.interval = 1.0 / rate
+		self.lock = threading.Lock()
+		self.next_call = 0.0
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			delay = self.next_call - now
+			self.next_call = max(now, self.next_call) + self.interval
+
+		if delay > 0:
+			time.sleep(delay)
+
+
+def get_concurrent_call(func, rate_limit=None):
+	"""Wrap `func` to return an (item, result, exception) tuple, spaced out by `rate_limit`"""
+	limiter = RateLimiter(rate_limit) if rate_limit else None
+
+	def _call(item):
+		if limiter:
+			limiter.wait()
+
+		try:
+			return item, func(item), None
+		except Exception as e:
+			return item, None, e
+
+	return _call
+
+
+def run_concurrently(func, items, max_workers=10, rate_limit=None):
+	"""Call `func` on each item from a thread pool.
+
+	Returns a list of (item, result, exception) tuples in the order of `items`.
+	`func` must not use `frappe.db`: the database connection is not shared with the threads.
+	"""
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		return list(executor.map(get_concurrent_call(func, rate_limit), items))
+
+
+def iter_concurrently(func, items, max_workers=10, rate_limit=None):
+	"""Call `func` on each item from a thread pool, yielding (item, result, exception) tuples
+	as the calls complete.
+
+	For batch jobs keeping many gateway calls in flight from one worker: the threads only make
+	the HTTP calls, and the caller handles each result on its own database connection while
+	the next calls are in flight. At most `max_workers` items are submitted at a time, so that
+	large batches are not all held as pending futures.
+	`func` must not use `frappe.db`: the database connection is not shared with the threads.
+	"""
+	call = get_concurrent_call(func, rate_limit)
+	items = iter(items)
+
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		pending = {executor.submit(call, item) for item in islice(items, max_workers)}
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				yield future.result()
+
+			pending.update(executor.submit(call, item) for item in islice(items, len(done)))
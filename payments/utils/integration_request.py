@@ -0,0 +1,203 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe.utils import flt
+
+from payments.utils import codec
+
+# Indexes of the hot access paths, created on install and after every migration, so that
+# the indexes of doctypes from apps installed later (ERPNext) are created as well
+INDEXES = {
+	"Integration Request": [
+		# Status scans by service: capture, reconciliation, abandoned checkouts
+		["status", "integration_request_service", "creation"],
+		# Archival of the requests in a final status
+		["status", "modified"],
+		["service_id"],
+		["payment_gateway_controller"],
+		["reference_doctype", "reference_docname"],
+		# Reconciliation of the payments by amount
+		["payment_amount"],
+	],
+	"Payment Request": [["payment_key"]],
+	"Integration References": [["customer", "stripe_settings"]],
+}
+
+# Keys read from `data` into indexed columns, in order of precedence
+PROJECTED_KEYS = {
+	"gateway_payment_id": ("razorpay_payment_id", "TXNID", "transaction_id", "payment_id"),
+	"payment_amount": ("amount", "TXNAMOUNT", "TXN_AMOUNT"),
+	"reference_doctype": ("reference_doctype",),
+	"reference_docname": ("reference_docname", "reference_name"),
+	"recurring_profile_id": ("profile_id",),
+}
+
+# Link fields set by the creator of the request: they are only filled from `data` when empty
+FILL_ONLY_PROJECTED_FIELDS = ("reference_doctype", "reference_docname")
+
+PROJECTION_BATCH_SIZE = 1000
+
+# Status changes allowed by `update_status`: final statuses cannot be left, and a request
+# that already moved forward cannot go back. Updating the data without changing the
+# status is always allowed.
+STATUS_TRANSITIONS = {
+	"Queued": ("Authorized", "Completed", "Failed", "Cancelled", "Expired"),
+	"Authorized": ("Completed", "Failed", "Cancelled"),
+	# Payments retried after a failure or completed after their checkout expired
+	"Failed": ("Queued", "Authorized", "Completed"),
+	"Expired": ("Queued", "Authorized", "Completed", "Failed", "Cancelled"),
+	"Completed": (),
+	"Cancelled": (),
+}
+
+
+def get_projected_fields(data, doc=None):
+	"""Return the values of the projected columns found in the `data` of an Integration Request.
+
+	The reference columns are left out when `doc`, the request or its current values, has them.
+	"""
+	if isinstance(data, str):
+		try:
+			data = codec.loads(data)
+		except ValueError:
+			return {}
+
+	if not isinstance(data, dict):
+		return {}
+
+	projected_fields = {}
+	for fieldname, keys in PROJECTED_KEYS.items():
+		value = next((data[key] for key in keys if data.get(key)), None)
+		if value is not None and not isinstance(value, (dict, list)):
+			projected_fields[fieldname] = value
+
+	if "payment_amount" in projected_fields:
+		projected_fields["payment_amount"] = flt(projected_fields["payment_amount"])
+
+	if doc:
+		for fieldname in FILL_ONLY_PROJECTED_FIELDS:
+			if doc.get(fieldname):
+				projected_fields.pop(fieldname, None)
+
+	return projected_fields
+
+
+def is_valid_status_transition(current_status, new_status):
+	if current_status == new_status or current_status not in STATUS_TRANSITIONS:
+		return True
+
+	return new_status in STATUS_TRANSITIONS[current_status]
+
+
+def make_projected_fields():
+	create_custom_fields(
+		{
+			"Integration Request": [
+				{
+					"fieldname": "gateway_payment_id",
+					"fieldtype": "Data",
+					"label": "Gateway Payment ID",
+					"read_only": 1,
+					"search_index": 1,
+					"insert_after": "integration_request_service",
+				},
+				{
+					"fieldname": "payment_amount",
+					"fieldtype": "Float",
+					"label": "Payment Amount",
+					"read_only": 1,
+					"insert_after": "gateway_payment_id",
+				},
+				{
+					"fieldname": "recurring_profile_id",
+					"fieldtype": "Data",
+					"label": "Recurring Profile ID",
+					"read_only": 1,
+					"search_index": 1,
+					"insert_after": "payment_amount",
+				},
+			]
+		}
+	)
+
+
+def make_status_version_field():
+	create_custom_fields(
+		{
+			"Integration Request": [
+				{
+					"fieldname": "status_version",
+					"fieldtype": "Int",
+					"label": "Status Version",
+					"read_only": 1,
+					"hidden": 1,
+					"no_copy": 1,
+					"insert_after": "status",
+				},
+			]
+		}
+	)
+
+
+def delete_integration_request_fields():
+	for fieldname in (
+		"gateway_payment_id",
+		"payment_amount",
+		"recurring_profile_id",
+		"status_version",
+	):
+		frappe.db.delete("Custom Field", {"name": "Integration Request-" + fieldname})
+
+	frappe.clear_cache(doctype="Integration Request")
+
+
+def add_indexes():
+	for doctype, indexes in INDEXES.items():
+		if not frappe.db.table_exists(doctype):
+			continue
+
+		for fields in indexes:
+			if all(frappe.db.has_column(doctype, field) for field in fields):
+				frappe.db.add_index(doctype, fields)
+
+
+def backfill_projected_fields():
+	"""Fill the projected columns of the existing Integration Requests"""
+	last_name = ""
+	while True:
+		requests = frappe.get_all(
+			"Integration Request",
+			filters={"name": (">", last_name)},
+			fields=["name", "data", *FILL_ONLY_PROJECTED_FIELDS],
+			order_by="name asc",
+			limit=PROJECTION_BATCH_SIZE,
+		)
+		if not requests:
+			break
+
+		for request in requests:
+			projected_fields = get_projected_fields(request.data, request)
+			if projected_fields:
+				frappe.db.set_value(
+					"Integration Request", request.name, projected_fields, update_modified=False
+				)
+
+		last_name = requests[-1].name
+		frappe.db.commit()
+
+
+def backfill_recurring_profile_ids():
+	"""Fill the recurring profile id of the existing PayPal recurring profiles"""
+	for request in frappe.get_all(
+		"Integration Request",
+		filters={"integration_request_service": "PayPal", "data": ("like", '%"profile_id"%')},
+		fields=["name", "data"],
+	):
+		projected_fields = get_projected_fields(request.data)
+		if projected_fields.get("recurring_profile_id"):
+			frappe.db.set_value(
+				"Integration Request",
+				request.name,
+				"recurring_profile_id",
+				projected_fields["recurring_profile_id"],
+				update_modified=False,
+			)
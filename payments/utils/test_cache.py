@@ -0,0 +1,20 @@
+# Copyright (c) 2026, Dokos SAS and Contributors
+# License: MIT. See LICENSE
+import unittest
+
+from payments.utils.cache import get_cached_controller
+
+
+class TestCachedController(unittest.TestCase):
+	def test_callers_do_not_share_state(self):
+		first = get_cached_controller("PayPal Settings")
+		second = get_cached_controller("PayPal Settings")
+
+		first.flags.status_changed_to = "Completed"
+		first.use_sandbox = 1
+
+		self.assertIsNot(first, second)
+		self.assertIsNot(first.flags, second.flags)
+		self.assertIsNone(second.flags.status_changed_to)
+		self.assertIsNone(get_cached_controller("PayPal Settings").flags.status_changed_to)
+		self.assertEqual(get_cached_controller("PayPal Settings").use_sandbox, 0)
@@ -0,0 +1,48 @@
+# Copyright (c) 2026, Dokos SAS and Contributors
+# License: MIT. See LICENSE
+import threading
+import time
+import unittest
+
+from payments.utils.http import iter_concurrently, run_concurrently
+
+
+class TestConcurrentCalls(unittest.TestCase):
+	def test_run_concurrently_keeps_the_order_of_items(self):
+		results = run_concurrently(lambda item: item * 2, [3, 1, 2], max_workers=3)
+		self.assertEqual(
+			[(item, result) for item, result, error in results], [(3, 6), (1, 2), (2, 4)]
+		)
+
+	def test_iter_concurrently_returns_errors(self):
+		def _call(item):
+			if item == 2:
+				raise ValueError(item)
+			return item
+
+		results = {
+			item: (result, error) for item, result, error in iter_concurrently(_call, range(5))
+		}
+
+		self.assertEqual(set(results), set(range(5)))
+		self.assertIsInstance(results[2][1], ValueError)
+		self.assertEqual(results[4], (4, None))
+
+	def test_iter_concurrently_limits_calls_in_flight(self):
+		lock = threading.Lock()
+		in_flight = []
+		max_in_flight = []
+
+		def _call(item):
+			with lock:
+				in_flight.append(item)
+				max_in_flight.append(len(in_flight))
+			time.sleep(0.01)
+			with lock:
+				in_flight.remove(item)
+			return item
+
+		results = list(iter_concurrently(_call, range(50), max_workers=5))
+
+		self.assertEqual(sorted(item for item, result, error in results), list(range(50)))
+		self.assertLessEqual(max(max_in_flight), 5)
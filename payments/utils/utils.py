@@ -2,19 +2,33 @@ import click
 import frappe
 from frappe import _
 from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe.utils import create_batch, now
+
+from payments.utils import codec
+from payments.utils.cache import get_cached_controller
+from payments.utils.checkout import add_expired_status
+from payments.utils.integration_request import (
+	add_indexes,
+	delete_integration_request_fields,
+	get_projected_fields,
+	make_projected_fields,
+	make_status_version_field,
+)
+
+BULK_INSERT_BATCH_SIZE = 500
 
 
 def get_payment_gateway_controller(payment_gateway):
 	"""Return payment gateway controller"""
-	gateway = frappe.get_doc("Payment Gateway", payment_gateway)
+	gateway = frappe.get_cached_doc("Payment Gateway", payment_gateway)
 	if gateway.gateway_controller is None:
 		try:
-			return frappe.get_doc(f"{payment_gateway} Settings")
+			return get_cached_controller(f"{payment_gateway} Settings")
 		except Exception:
 			frappe.throw(_("{0} Settings not found").format(payment_gateway))
 	else:
 		try:
-			return frappe.get_doc(gateway.gateway_settings, gateway.gateway_controller)
+			return get_cached_controller(gateway.gateway_settings, gateway.gateway_controller)
 		except Exception:
 			frappe.throw(_("{0} Settings not found").format(payment_gateway))
 
@@ -23,7 +37,7 @@ def get_payment_gateway_controller(payment_gateway):
 def get_checkout_url(**kwargs):
 	try:
 		if kwargs.get("payment_gateway"):
-			doc = frappe.get_doc("{} Settings".format(kwargs.get("payment_gateway")))
+			doc = get_cached_controller("{} Settings".format(kwargs.get("payment_gateway")))
 			return doc.get_payment_url(**kwargs)
 		else:
 			raise Exception
@@ -38,6 +52,74 @@ def get_checkout_url(**kwargs):
 		)
 
 
+def get_payment_urls(payment_gateway, payment_details):
+	"""Return the checkout url of each payment, keyed by reference document name.
+
+	`payment_details` is a list of the arguments `get_payment_url` would receive.
+	Gateways implementing `get_payment_urls` insert their Integration Requests in batches
+	and make their setup calls concurrently. The url is None if a payment could not be set up.
+	"""
+	controller = get_payment_gateway_controller(payment_gateway)
+	if hasattr(controller, "get_payment_urls"):
+		return controller.get_payment_urls(payment_details)
+
+	return {
+		details["reference_docname"]: controller.get_payment_url(**details)
+		for details in payment_details
+	}
+
+
+def create_request_logs(payment_details, service_name, names=None):
+	"""Insert one queued Integration Request per payment, in batches.
+
+	Returns the names of the Integration Requests, in the order of `payment_details`.
+	"""
+	names = names or [frappe.generate_hash(length=10) for _ in payment_details]
+	timestamp = now()
+	user = frappe.session.user
+
+	fields = [
+		"name",
+		"creation",
+		"modified",
+		"owner",
+		"modified_by",
+		"integration_request_service",
+		"status",
+		"data",
+		"reference_doctype",
+		"reference_docname",
+		"gateway_payment_id",
+		"payment_amount",
+		"recurring_profile_id",
+	]
+	values = []
+	for name, details in zip(names, payment_details):
+		projected_fields = get_projected_fields(details)
+		values.append(
+			(
+				name,
+				timestamp,
+				timestamp,
+				user,
+				user,
+				service_name,
+				"Queued",
+				codec.dumps(details),
+				projected_fields.get("reference_doctype"),
+				projected_fields.get("reference_docname"),
+				projected_fields.get("gateway_payment_id"),
+				projected_fields.get("payment_amount"),
+				projected_fields.get("recurring_profile_id"),
+			)
+		)
+
+	for batch in create_batch(values, BULK_INSERT_BATCH_SIZE):
+		frappe.db.bulk_insert("Integration Request", fields, batch)
+
+	return names
+
+
 def create_payment_gateway(gateway, settings=None, controller=None):
 	# NOTE: we don't translate Payment Gateway name because it is an internal doctype
 	if not frappe.db.exists("Payment Gateway", gateway):
@@ -53,8 +135,15 @@ def create_payment_gateway(gateway, settings=None, controller=None):
 
 def after_install():
 	make_custom_fields()
+	add_expired_status()
+	make_projected_fields()
+	make_status_version_field()
+	add_indexes()
 	patch_erpnext_webhooks_url()
 
+def after_migrate():
+	add_indexes()
+
 def make_custom_fields():
 	if not frappe.get_meta("Web Form").has_field("payments_tab"):
 		click.secho("* Installing Payment Custom Fields in Web Form")
@@ -160,6 +249,8 @@ def delete_custom_fields():
 
 		frappe.clear_cache(doctype="Web Form")
 
+	delete_integration_request_fields()
+
 def patch_erpnext_webhooks_url():
 	# TODO: Remove this after v3
 	from payments.payment_gateways.doctype.stripe_settings.stripe_settings import create_delete_webhooks, delete_webhooks